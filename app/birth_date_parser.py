@@ -698,34 +698,28 @@ class BirthDateParser:
                 }
             }
             
-            # คำนวณ Ascendant ถ้ามีเวลาเกิด
+            # คำนวณ Ascendant และบ้านทั้ง 12 บ้าน ถ้ามีเวลาเกิด (คำนวณ LST ครั้งเดียว)
             if birth_time:
                 try:
-                    ascendant_data = self.astronomical_calculator.calculate_ascendant(
+                    chart_data = self.astronomical_calculator.calculate_chart(
                         birth_datetime, latitude, longitude
                     )
+                    ascendant_data = chart_data['ascendant'] if chart_data else None
                     if ascendant_data:
                         chart_info['ascendant'] = ascendant_data
                         chart_info['ascendant_interpretation'] = self.astronomical_calculator.get_ascendant_interpretation(ascendant_data)
                         logger.info(f"✅ Calculated Ascendant: {ascendant_data['sign']} {ascendant_data['degree']:.1f}°")
                     else:
                         logger.warning("Failed to calculate Ascendant")
-                except Exception as e:
-                    logger.error(f"Error calculating Ascendant: {e}")
-            
-            # คำนวณบ้านทั้ง 12 บ้าน ถ้ามีเวลาเกิด
-            if birth_time:
-                try:
-                    houses_data = self.astronomical_calculator.calculate_house_cusps(
-                        birth_datetime, latitude, longitude
-                    )
+                    
+                    houses_data = chart_data['houses'] if chart_data else None
                     if houses_data:
                         chart_info['houses'] = houses_data
                         logger.info(f"✅ Calculated 12 houses")
                     else:
                         logger.warning("Failed to calculate houses")
                 except Exception as e:
-                    logger.error(f"Error calculating houses: {e}")
+                    logger.error(f"Error calculating Ascendant/houses: {e}")
 
             # 🆕 คำนวณตำแหน่งดาวเคราะห์ (Planets) - คำนวณเสมอแม้ไม่มีเวลาเกิด (ใช้เวลาเที่ยงถ้าไม่ระบุ แต่ในที่นี้ birth_datetime มีค่าเสมอ)
             try:
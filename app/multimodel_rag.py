@@ -1,30 +1,77 @@
 import os
-import io
 import base64
 import tempfile
 import fitz  # PyMuPDF
 import pdfplumber
 from PIL import Image
 from dotenv import load_dotenv
-from pymongo import MongoClient
+from pymongo import MongoClient, UpdateOne
+from pymongo.operations import SearchIndexModel
+from pymongo.errors import AutoReconnect, BulkWriteError
+from pymongo.write_concern import WriteConcern
+import gridfs
+from bson.binary import Binary, BinaryVectorDtype
 from datetime import datetime
 import json
 import gc
+import time
 import psutil
 import re
+import hashlib
+import functools
+import itertools
+import importlib.util
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from itertools import repeat
+from operator import itemgetter
+from collections import Counter
+import numpy as np
 from sentence_transformers import SentenceTransformer
 
-# 🆕 เพิ่ม PyThaiNLP สำหรับปรับปรุง OCR
+# Import numba สำหรับ JIT-compile ขั้นตอนรวม text blocks (ถ้าไม่มีจะรันเป็น Python ปกติ)
 try:
-    from pythainlp import word_tokenize
-    from pythainlp.spell import correct
-    from pythainlp.util import normalize
-    PYTHAINLP_AVAILABLE = True
-    print("✅ PyThaiNLP loaded successfully")
+    from numba import njit
+    NUMBA_AVAILABLE = True
 except ImportError:
-    PYTHAINLP_AVAILABLE = False
+    NUMBA_AVAILABLE = False
+
+    def njit(*args, **kwargs):
+        # ใช้ได้ทั้งแบบ @njit และ @njit(...) - คืนฟังก์ชันเดิม
+        if len(args) == 1 and callable(args[0]) and not kwargs:
+            return args[0]
+        return lambda func: func
+
+# 🆕 เพิ่ม PyThaiNLP สำหรับปรับปรุง OCR
+# ตรวจแค่ว่าติดตั้งไว้หรือไม่ ส่วน import จริงทำตอน OCR ครั้งแรก (PyThaiNLP ใช้ memory มาก
+# process ที่ไม่ได้ทำ OCR เช่น webhook ที่ import โมดูลนี้ จึงไม่ต้องโหลด)
+PYTHAINLP_AVAILABLE = importlib.util.find_spec("pythainlp") is not None
+if not PYTHAINLP_AVAILABLE:
     print("⚠️ PyThaiNLP not available, using basic text processing")
 
+def get_pythainlp():
+    """โหลด PyThaiNLP แบบ lazy loading คืนค่า (word_tokenize, correct, dictionary_words)"""
+    if not hasattr(get_pythainlp, 'modules'):
+        from pythainlp import word_tokenize
+        from pythainlp.spell import correct
+        from pythainlp.corpus import thai_words
+        get_pythainlp.modules = (word_tokenize, functools.lru_cache(maxsize=100_000)(correct), thai_words())
+        print("✅ PyThaiNLP loaded successfully")
+    return get_pythainlp.modules
+
+# ข้อความสั้น (เช่น ป้ายกำกับในรูป) ซ้ำกันบ่อย จึง cache ผลการตัดคำไว้
+TOKENIZE_CACHE_MAX_LEN = 64
+
+@functools.lru_cache(maxsize=10_000)
+def _tokenize_short_cached(text):
+    """ตัดคำข้อความสั้นด้วย PyThaiNLP (cache ตามข้อความ คืนค่าเป็น tuple)"""
+    word_tokenize = get_pythainlp()[0]
+    return tuple(word_tokenize(text, engine='newmm-safe'))
+
+def _has_thai(word):
+    """ตรวจว่าคำมีอักษรไทยอย่างน้อยหนึ่งตัว"""
+    return any('\u0e00' <= c <= '\u0e7f' for c in word)
+
 # ✅ แก้ไขปัญหา MPS device, PIL.ANTIALIAS และ tokenizers parallelism
 os.environ['PYTORCH_ENABLE_MPS_FALLBACK'] = '1'
 os.environ['TOKENIZERS_PARALLELISM'] = 'false'
@@ -40,11 +87,45 @@ PDF_PATH = "data/attention.pdf"
 MONGO_URL = os.getenv("MONGO_URL")
 ORIGINAL_DB_NAME = "astrobot_original"  # สำหรับเก็บไฟล์ต้นฉบับที่ extract แล้ว
 
+# จำนวน process ที่ใช้ extract หน้า PDF พร้อมกัน (แต่ละ process โหลด OCR model ของตัวเอง)
+PDF_WORKERS = int(os.getenv("PDF_WORKERS", os.cpu_count() or 1))
+# Typhoon OCR รับเป็น path ของไฟล์เท่านั้น จึงเขียนไฟล์ชั่วคราวลง tmpfs (/dev/shm อยู่ใน RAM) ถ้ามี
+OCR_TMP_DIR = "/dev/shm" if os.path.isdir("/dev/shm") and os.access("/dev/shm", os.W_OK) else tempfile.gettempdir()
+# cache ผล OCR ตาม hash ของรูป (รัน pipeline ซ้ำกับ PDF เดิมไม่ต้องเรียก OCR ใหม่) เก็บเป็นไฟล์ละรูป
+# จึงใช้ร่วมกันระหว่าง worker process ได้โดยไม่ต้องล็อก
+OCR_CACHE_DIR = os.getenv("OCR_CACHE_DIR", os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".cache", "ocr")))
+# จำนวน request ของ Typhoon OCR ที่ส่งพร้อมกันสูงสุด (เป็น network call จึงใช้ thread ได้)
+# ตอนรัน main() เป็นเพดานรวมทุก worker process (ใช้ semaphore ร่วมกัน) ไม่ใช่ต่อ process
+TYPHOON_OCR_WORKERS = int(os.getenv("TYPHOON_OCR_WORKERS", 8))
+# PIPELINE_VERBOSE=1 แสดงสถิติ chunks และความคืบหน้าของทุกหน้า (ใช้ตอน debug)
+# ปกติ main() แสดงความคืบหน้าทุก PROGRESS_EVERY_PAGES หน้า
+PIPELINE_VERBOSE = os.getenv("PIPELINE_VERBOSE", "0") == "1"
+PROGRESS_EVERY_PAGES = 10
+
 # ✅ ตัวแปรระบบ - Collection Names
 # สำหรับข้อมูลต้นฉบับ (ORIGINAL_DB_NAME)
 ORIGINAL_TEXT_COLLECTION = "original_text_chunks"
 ORIGINAL_IMAGE_COLLECTION = "original_image_chunks"
 ORIGINAL_TABLE_COLLECTION = "original_table_chunks"
+ORIGINAL_IMAGE_BUCKET = "original_images"  # GridFS bucket เก็บไฟล์รูปต้นฉบับ (image chunk เก็บแค่ image_id)
+EMBED_CACHE_COLLECTION = "embed_cache"  # cache embedding ตาม hash ของข้อความ (ไม่ถูกลบตอนรัน pipeline ใหม่)
+
+# ✅ Embedding model
+EMBEDDING_MODEL_NAME = "minishlab/potion-multilingual-128M"
+EMBEDDING_DIMENSIONS = 256  # ขนาด vector ของ EMBEDDING_MODEL_NAME (ใช้สร้าง Vector Search index โดยไม่ต้องโหลด model)
+EMBEDDING_BATCH_SIZE = 64
+# EMBED_FP16=1 เก็บ weight ของ embedding model เป็น float16 (ใช้ RAM ครึ่งเดียว)
+# potion เป็น static embedding (ไม่มี Linear layer) การทำ dynamic int8 quantization จึงไม่มีผล
+EMBED_FP16 = os.getenv("EMBED_FP16", "0") == "1"
+STORE_BATCH_SIZE = 100  # จำนวน chunks ต่อการ insert หนึ่งครั้งใน store_original_data_in_mongodb
+# main() สะสม chunks หลายหน้าแล้วค่อย insert เมื่อครบจำนวนนี้ (ลดจำนวน round-trip ไป Atlas)
+INSERT_FLUSH_CHUNKS = int(os.getenv("INSERT_FLUSH_CHUNKS", 1000))
+# write concern ตอน bulk load: รอแค่ primary ไม่รอ journal/majority (ข้อมูลสร้างใหม่จาก PDF ได้เสมอ)
+BULK_LOAD_WRITE_CONCERN = WriteConcern(w=1, j=False)
+INSERT_RETRIES = 3  # จำนวนครั้งที่ลอง insert ใหม่เมื่อการเชื่อมต่อขัดข้องชั่วคราว (รอ 1, 2, 4 วินาที)
+VECTOR_INDEX_NAME = "embeddings_vector_index"  # ชื่อ Atlas Vector Search index บน field embeddings
+# บีบอัดข้อมูลที่ส่งไป Atlas (chunks มีข้อความยาวจำนวนมาก) ใช้ zstd ถ้า server รองรับ ไม่งั้น zlib
+MONGO_COMPRESSORS = os.getenv("MONGO_COMPRESSORS", "zstd,zlib")
 
 # ✅ ฟังก์ชันแปลง bbox เป็น format ที่ MongoDB สามารถ encode ได้
 def convert_bbox_to_mongodb_format(bbox):
@@ -61,12 +142,14 @@ def convert_bbox_to_mongodb_format(bbox):
         return None
     
     try:
+        # ถ้าเป็น tuple หรือ list (กรณีส่วนใหญ่: bbox จาก get_text/get_image_info/pdfplumber ตรวจก่อน)
+        if isinstance(bbox, (tuple, list)):
+            if len(bbox) >= 4:
+                return (float(bbox[0]), float(bbox[1]), float(bbox[2]), float(bbox[3]))
+            return None
         # ถ้าเป็น pymupdf.Rect object
-        if hasattr(bbox, 'x0') and hasattr(bbox, 'y0') and hasattr(bbox, 'x1') and hasattr(bbox, 'y1'):
+        elif hasattr(bbox, 'x0') and hasattr(bbox, 'y0') and hasattr(bbox, 'x1') and hasattr(bbox, 'y1'):
             return (float(bbox.x0), float(bbox.y0), float(bbox.x1), float(bbox.y1))
-        # ถ้าเป็น tuple หรือ list
-        elif isinstance(bbox, (tuple, list)) and len(bbox) >= 4:
-            return (float(bbox[0]), float(bbox[1]), float(bbox[2]), float(bbox[3]))
         else:
             return None
     except Exception as e:
@@ -74,42 +157,94 @@ def convert_bbox_to_mongodb_format(bbox):
         return None
 
 # ✅ ฟังก์ชันตรวจสอบ memory
-def check_memory():
-    """ตรวจสอบการใช้ memory"""
+MEMORY_CHECK_INTERVAL = 5.0  # วินาที: ตรวจ memory ใน loop ได้ไม่บ่อยกว่านี้
+
+def check_memory(force=False):
+    """
+    ตรวจสอบการใช้ memory
+    เรียกจาก loop ได้บ่อยตามต้องการ: จะอ่านค่าจริงเมื่อผ่านไป MEMORY_CHECK_INTERVAL วินาทีแล้วเท่านั้น
+    (force=True ตรวจทันที ใช้ตอนเริ่ม/จบแต่ละขั้น)
+    """
+    now = time.monotonic()
+    if not force and now - getattr(check_memory, 'last_check', float('-inf')) < MEMORY_CHECK_INTERVAL:
+        return
+    check_memory.last_check = now
+    
     memory = psutil.virtual_memory()
     print(f"💾 Memory: {memory.percent}% ({memory.used / 1024**3:.1f}GB / {memory.total / 1024**3:.1f}GB)")
     if memory.percent > 80:
         print("⚠️ High memory usage, running garbage collection...")
         gc.collect()
 
+# ✅ Regex สำหรับทำความสะอาดข้อความ OCR (compile ครั้งเดียวตอน import)
+# ตำแหน่งรอยต่อไทย-อังกฤษ/ตัวเลข ทั้งสองทิศทาง รวมเป็น pattern เดียวเพื่อเดินผ่านข้อความรอบเดียว
+_RE_SCRIPT_BOUNDARY = re.compile(r'(?<=[ก-๙])(?=[A-Za-z0-9])|(?<=[A-Za-z0-9])(?=[ก-๙])')
+_RE_WS = re.compile(r'\s+')
+_RE_THAI_CHAR = re.compile(r'[ก-๙]')
+
+# Regex สำหรับแปลง markdown จาก Typhoon OCR เป็นข้อความธรรมดา
+# header/bold/italic/code/link รวมเป็น pattern เดียว (bold อยู่ก่อน italic) เดินผ่านข้อความรอบเดียว
+_RE_MARKDOWN = re.compile(
+    r'#+\s*'                              # header → ลบทิ้ง
+    r'|\*\*(?P<bold>[^*]+)\*\*'
+    r'|\*(?P<italic>[^*]+)\*'
+    r'|`(?P<code>[^`]+)`'
+    r'|\[(?P<link>[^\]]+)\]\([^\)]+\)'
+)
+
+def _strip_markdown_match(match):
+    """คืนเนื้อหาข้างใน markdown syntax ที่ match (header คืนค่าว่าง)"""
+    return match.group(match.lastgroup) if match.lastgroup else ''
+
+# ข้อความ OCR ที่ซ้ำกัน (ป้ายกำกับ, หัวตาราง) ไม่ต้องปรับปรุงใหม่ทุกครั้ง
+# ข้อความที่ยาวเกินนี้มักไม่ซ้ำ จึงไม่เก็บใน cache ให้เปลือง memory
+IMPROVE_CACHE_MAX_LEN = 2000
+
 # 🆕 ฟังก์ชันปรับปรุงข้อความไทยจาก OCR ด้วย PyThaiNLP
 def improve_thai_ocr_text(ocr_text):
     """
-    ปรับปรุงข้อความไทยจาก OCR ด้วย PyThaiNLP
+    ปรับปรุงข้อความไทยจาก OCR ด้วย PyThaiNLP (ข้อความสั้นกว่า IMPROVE_CACHE_MAX_LEN ถูก cache ไว้)
     """
+    if len(ocr_text) > IMPROVE_CACHE_MAX_LEN:
+        return _improve_thai_ocr_text(ocr_text)
+    return _improve_thai_ocr_text_cached(ocr_text)
+
+@functools.lru_cache(maxsize=4096)
+def _improve_thai_ocr_text_cached(ocr_text):
+    """improve_thai_ocr_text แบบ cache ตามข้อความ"""
+    return _improve_thai_ocr_text(ocr_text)
+
+def _improve_thai_ocr_text(ocr_text):
+    """ปรับปรุงข้อความไทยจาก OCR (ตัดคำ + แก้คำผิด) โดยไม่ผ่าน cache"""
     if not PYTHAINLP_AVAILABLE or not ocr_text.strip():
         return ocr_text
     
+    # ข้อความที่ไม่มีอักษรไทย (ตัวเลข/อังกฤษ) ไม่ต้องตัดคำและแก้คำผิด แค่จัดช่องว่าง
+    if not _RE_THAI_CHAR.search(ocr_text):
+        return _RE_WS.sub(' ', ocr_text).strip()
+    
     try:
         # ทำความสะอาดข้อความ
         text = ocr_text.strip()
         
-        # แก้ไขการเว้นวรรคที่ผิด
-        text = re.sub(r'([ก-๙])([A-Za-z])', r'\1 \2', text)  # เว้นวรรคระหว่างไทย-อังกฤษ
-        text = re.sub(r'([A-Za-z])([ก-๙])', r'\1 \2', text)  # เว้นวรรคระหว่างอังกฤษ-ไทย
-        text = re.sub(r'([ก-๙])([0-9])', r'\1 \2', text)    # เว้นวรรคระหว่างไทย-ตัวเลข
-        text = re.sub(r'([0-9])([ก-๙])', r'\1 \2', text)    # เว้นวรรคระหว่างตัวเลข-ไทย
+        # แก้ไขการเว้นวรรคที่ผิด (เว้นวรรคระหว่างไทย กับ อังกฤษ/ตัวเลข ทั้งสองทิศทาง)
+        text = _RE_SCRIPT_BOUNDARY.sub(' ', text)
         
         # แก้ไขการเว้นวรรคที่ซ้ำ
-        text = re.sub(r'\s+', ' ', text)
+        text = _RE_WS.sub(' ', text)
         
-        # แบ่งคำด้วย PyThaiNLP
-        words = word_tokenize(text, engine='newmm')
+        # แบ่งคำด้วย PyThaiNLP (newmm-safe ไม่ค้างกับข้อความยาวที่ไม่มีช่องว่าง)
+        word_tokenize, correct, dictionary_words = get_pythainlp()
+        if len(text) <= TOKENIZE_CACHE_MAX_LEN:
+            words = _tokenize_short_cached(text)
+        else:
+            words = word_tokenize(text, engine='newmm-safe')
         
         # แก้ไขคำผิดด้วย PyThaiNLP
+        # เฉพาะคำภาษาไทยที่ยาวกว่า 2 ตัวอักษรและไม่อยู่ในพจนานุกรม (correct ถูก cache ตามคำ)
         corrected_words = []
         for word in words:
-            if len(word) > 2 and word.isalpha():  # แก้ไขเฉพาะคำที่มีความยาวมากกว่า 2 ตัวอักษร
+            if len(word) > 2 and word.isalpha() and _has_thai(word) and word not in dictionary_words:
                 try:
                     corrected = correct(word)
                     corrected_words.append(corrected if corrected else word)
@@ -122,7 +257,7 @@ def improve_thai_ocr_text(ocr_text):
         improved_text = ' '.join(corrected_words)
         
         # ทำความสะอาดอีกครั้ง
-        improved_text = re.sub(r'\s+', ' ', improved_text).strip()
+        improved_text = _RE_WS.sub(' ', improved_text).strip()
         
         return improved_text
         
@@ -152,10 +287,48 @@ def get_ocr_reader():
         except (ImportError, ValueError) as e:
             print(f"⚠️ Typhoon OCR not available ({e}), falling back to EasyOCR")
             import easyocr
-            get_ocr_reader.reader = easyocr.Reader(['en', 'th'], gpu=False, verbose=False)
+            import torch
+            get_ocr_reader.reader = easyocr.Reader(
+                ['en', 'th'], gpu=torch.cuda.is_available(), cudnn_benchmark=True, verbose=False
+            )
             get_ocr_reader.ocr_document = None
     return get_ocr_reader.reader
 
+def _init_ocr_worker(typhoon_slots):
+    """
+    initializer ของ worker process ใน main(): เก็บ semaphore ที่ใช้ร่วมกันทุก process
+    เพื่อจำกัดจำนวน request ของ Typhoon OCR ทั้ง pipeline ไว้ที่ TYPHOON_OCR_WORKERS
+    """
+    get_ocr_reader.typhoon_slots = typhoon_slots
+
+def _ocr_cache_path(image_bytes, engine):
+    """path ของไฟล์ cache สำหรับรูปนี้ (แยกตาม OCR engine)"""
+    key = hashlib.blake2b(image_bytes, digest_size=16).hexdigest()
+    return os.path.join(OCR_CACHE_DIR, engine, f"{key}.txt")
+
+def read_ocr_cache(image_bytes, engine):
+    """อ่านข้อความ OCR ดิบจาก cache คืน None ถ้ายังไม่มี"""
+    try:
+        with open(_ocr_cache_path(image_bytes, engine), encoding="utf-8") as f:
+            return f.read()
+    except FileNotFoundError:
+        return None
+    except OSError as e:
+        print(f"⚠️ Error reading OCR cache: {e}")
+        return None
+
+def write_ocr_cache(image_bytes, engine, ocr_text):
+    """บันทึกข้อความ OCR ดิบลง cache (เขียนไฟล์ชั่วคราวแล้ว rename เพื่อไม่ให้ process อื่นอ่านไฟล์ที่เขียนไม่เสร็จ)"""
+    path = _ocr_cache_path(image_bytes, engine)
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(ocr_text)
+        os.replace(tmp_path, path)
+    except OSError as e:
+        print(f"⚠️ Error writing OCR cache: {e}")
+
 def perform_ocr_on_image_bytes(image_bytes):
     """
     ทำ OCR บน image bytes โดยใช้ Typhoon OCR หรือ EasyOCR (fallback)
@@ -171,31 +344,39 @@ def perform_ocr_on_image_bytes(image_bytes):
     """
     reader = get_ocr_reader()
     ocr_text = ""
+    engine = "typhoon" if reader == "typhoon_ocr" else "easyocr"
     
+    # ใช้ผล OCR จาก cache ถ้าเคยทำรูปนี้แล้ว
+    cached_text = read_ocr_cache(image_bytes, engine)
+    if cached_text is not None:
+        ocr_text = cached_text
     # ตรวจสอบว่าใช้ Typhoon OCR หรือ EasyOCR
-    if reader == "typhoon_ocr" and hasattr(get_ocr_reader, 'ocr_document'):
+    elif reader == "typhoon_ocr" and hasattr(get_ocr_reader, 'ocr_document'):
         try:
-            # สร้างไฟล์ชั่วคราว
-            with tempfile.NamedTemporaryFile(delete=False, suffix='.png') as tmp_file:
+            # สร้างไฟล์ชั่วคราว (บน tmpfs ไม่ต้องเขียน/อ่านดิสก์)
+            with tempfile.NamedTemporaryFile(delete=False, suffix='.png', dir=OCR_TMP_DIR) as tmp_file:
                 tmp_file.write(image_bytes)
                 tmp_path = tmp_file.name
             
             try:
-                # เรียกใช้ Typhoon OCR
+                # เรียกใช้ Typhoon OCR (รอ slot ว่างก่อน ถ้ารันใน worker ของ main())
                 ocr_document = get_ocr_reader.ocr_document
-                markdown_text = ocr_document(pdf_or_image_path=tmp_path)
+                typhoon_slots = getattr(get_ocr_reader, 'typhoon_slots', None)
+                if typhoon_slots is not None:
+                    typhoon_slots.acquire()
+                try:
+                    markdown_text = ocr_document(pdf_or_image_path=tmp_path)
+                finally:
+                    if typhoon_slots is not None:
+                        typhoon_slots.release()
                 
                 # แปลง markdown เป็น plain text (ลบ markdown syntax)
                 # ลบ markdown headers, bold, italic, etc.
-                text = re.sub(r'#+\s*', '', markdown_text)  # ลบ headers
-                text = re.sub(r'\*\*([^*]+)\*\*', r'\1', text)  # ลบ bold
-                text = re.sub(r'\*([^*]+)\*', r'\1', text)  # ลบ italic
-                text = re.sub(r'`([^`]+)`', r'\1', text)  # ลบ code
-                text = re.sub(r'\[([^\]]+)\]\([^\)]+\)', r'\1', text)  # ลบ links
-                text = re.sub(r'\n+', ' ', text)  # แทนที่ newlines ด้วย space
-                text = re.sub(r'\s+', ' ', text).strip()  # ลบ spaces ซ้ำ
+                text = _RE_MARKDOWN.sub(_strip_markdown_match, markdown_text)  # ลบ headers, bold, italic, code, links
+                text = _RE_WS.sub(' ', text).strip()  # แทนที่ newlines และ spaces ซ้ำด้วย space เดียว
                 
                 ocr_text = text
+                write_ocr_cache(image_bytes, engine, ocr_text)
             finally:
                 # ลบไฟล์ชั่วคราว
                 if os.path.exists(tmp_path):
@@ -211,6 +392,7 @@ def perform_ocr_on_image_bytes(image_bytes):
         # ใช้ EasyOCR (fallback)
         ocr_results = reader.readtext(image_bytes)
         ocr_text = " ".join([result[1] for result in ocr_results if result[2] > 0.3])
+        write_ocr_cache(image_bytes, engine, ocr_text)
     
     # 🆕 ปรับปรุงข้อความด้วย PyThaiNLP
     original_text = ocr_text.strip() if ocr_text else ""
@@ -220,22 +402,131 @@ def perform_ocr_on_image_bytes(image_bytes):
     
     return (original_text, original_text)
 
+# ✅ จำนวนรูปต่อ batch ของ OCR (EasyOCR batch ได้เฉพาะรูปขนาดเท่ากัน จึงจัดกลุ่มตามขนาดจริง ไม่ resize)
+OCR_BATCH_SIZE = 16
+
+def perform_ocr_on_images_batched(images):
+    """
+    ทำ OCR หลายรูปพร้อมกัน: EasyOCR ใช้ readtext_batched กับรูปที่ขนาดเท่ากัน (ลดจำนวนรอบ forward pass)
+    ส่วน Typhoon OCR เป็น API ทีละไฟล์ จึงส่ง request ของแต่ละรูปพร้อมกันด้วย thread pool
+    
+    Args:
+        images: list ของ (image_bytes, width, height) (ขนาดจาก extract_image ของ PyMuPDF)
+        
+    Returns:
+        list: (original_text, improved_text) ตามลำดับเดียวกับ input
+    """
+    reader = get_ocr_reader()
+    if reader == "typhoon_ocr":
+        if len(images) <= 1:
+            return [perform_ocr_on_image_bytes(image_bytes) for image_bytes, _, _ in images]
+        with ThreadPoolExecutor(max_workers=min(TYPHOON_OCR_WORKERS, len(images))) as pool:
+            # map คืนผลตามลำดับ input
+            return list(pool.map(perform_ocr_on_image_bytes, (image_bytes for image_bytes, _, _ in images)))
+    
+    # ใช้ผล OCR จาก cache ก่อน (ไม่ resize รูป ผลจึงเท่ากับ readtext ทีละรูป ใช้ cache ร่วมกันได้)
+    engine = "easyocr"
+    ocr_texts = [read_ocr_cache(image_bytes, engine) for image_bytes, _, _ in images]
+    
+    # จัดกลุ่มรูปที่ยังไม่มีใน cache ตามขนาดจริง (readtext_batched ต้องการรูปขนาดเท่ากันทั้ง batch)
+    groups = {}
+    for idx, (_, width, height) in enumerate(images):
+        if ocr_texts[idx] is None:
+            groups.setdefault((width, height), []).append(idx)
+    
+    for indices in groups.values():
+        # ส่ง bytes ให้ EasyOCR decode เอง (ลำดับ channel เหมือน readtext ทีละรูป)
+        image_list = [images[idx][0] for idx in indices]
+        try:
+            if len(image_list) == 1:
+                batch_results = [reader.readtext(image_list[0])]
+            else:
+                batch_results = reader.readtext_batched(image_list, batch_size=OCR_BATCH_SIZE)
+        except ValueError:
+            # ขนาดที่ decode ได้จริงไม่ตรงกับที่ PyMuPDF รายงาน: ทำทีละรูปแทน
+            batch_results = [reader.readtext(image_bytes) for image_bytes in image_list]
+        for idx, ocr_results in zip(indices, batch_results):
+            ocr_texts[idx] = " ".join([result[1] for result in ocr_results if result[2] > 0.3])
+            write_ocr_cache(images[idx][0], engine, ocr_texts[idx])
+    
+    # 🆕 ปรับปรุงข้อความด้วย PyThaiNLP
+    results = []
+    for ocr_text in ocr_texts:
+        original_text = ocr_text.strip()
+        if original_text:
+            results.append((original_text, improve_thai_ocr_text(original_text)))
+        else:
+            results.append((original_text, original_text))
+    return results
+
 # ✅ ฟังก์ชันโหลด embedding model แบบ lazy loading
 def get_embedding_model():
     """โหลด embedding model แบบ lazy loading"""
     if not hasattr(get_embedding_model, 'model'):
         print("🔄 Loading embedding model...")
-        get_embedding_model.model = SentenceTransformer("minishlab/potion-multilingual-128M", device="cpu")
+        model = SentenceTransformer(EMBEDDING_MODEL_NAME, device="cpu")
+        if EMBED_FP16:
+            dimensions = model.get_sentence_embedding_dimension()
+            try:
+                model.half()
+                probe = model.encode("ทดสอบ", convert_to_numpy=True)
+                if probe.shape != (dimensions,) or not np.isfinite(probe).all():
+                    raise ValueError(f"unexpected output shape {probe.shape}")
+                print("✅ Embedding model weights converted to float16")
+            except Exception as e:
+                print(f"⚠️ float16 embedding model not supported ({e}), using float32")
+                model.float()
+        if model.get_sentence_embedding_dimension() != EMBEDDING_DIMENSIONS:
+            print(f"⚠️ Embedding model ให้ vector {model.get_sentence_embedding_dimension()} มิติ "
+                  f"แต่ EMBEDDING_DIMENSIONS = {EMBEDDING_DIMENSIONS} (Vector Search index จะไม่ตรงกัน)")
+        get_embedding_model.model = model
         print("✅ Embedding model loaded successfully")
     return get_embedding_model.model
 
+# ✅ ฟังก์ชันสร้าง key ของ embedding cache
+def embedding_cache_key(text):
+    """
+    สร้าง key จาก hash ของชื่อ model + ข้อความ (embedding ขึ้นกับข้อความเท่านั้น ไม่ขึ้นกับประเภท chunk)
+    """
+    return hashlib.blake2b(f"{EMBEDDING_MODEL_NAME}\0{text}".encode("utf-8"), digest_size=16).hexdigest()
+
+# ✅ ฟังก์ชันเตรียม collection สำหรับ embedding cache
+def get_embed_cache_collection(client):
+    """
+    คืน collection ของ embedding cache พร้อม unique index บน key (สร้าง index ซ้ำได้ไม่มีผล)
+    """
+    collection = client[ORIGINAL_DB_NAME][EMBED_CACHE_COLLECTION]
+    try:
+        collection.create_index([("key", 1)], unique=True)
+    except Exception as e:
+        print(f"⚠️ ไม่สามารถสร้าง index ของ embedding cache ได้: {e}")
+    return collection
+
+def _pack_cached_embedding(vector):
+    """แปลง embedding เป็น float16 Binary สำหรับเก็บใน embedding cache (เล็กกว่า list ของ double 4 เท่า)"""
+    return Binary(np.asarray(vector, dtype=np.float16).tobytes())
+
+def _unpack_cached_embedding(value):
+    """แปลงค่าจาก embedding cache กลับเป็น list of floats (รองรับ cache รุ่นเก่าที่เก็บเป็น list)"""
+    if isinstance(value, bytes):
+        return np.frombuffer(value, dtype=np.float16).astype(np.float32).tolist()
+    return value
+
+@functools.lru_cache(maxsize=4096)
+def _encode_text_cached(text):
+    """สร้าง embedding ด้วย model (cache ใน process ตามข้อความ)"""
+    return tuple(get_embedding_model().encode(text, convert_to_numpy=True).tolist())
+
 # ✅ ฟังก์ชันสร้าง embedding สำหรับข้อความ
-def create_text_embedding(text):
+def create_text_embedding(text, cache_collection=None):
     """
     สร้าง embedding สำหรับข้อความ
+    ถ้าส่ง cache_collection มาจะอ่าน/บันทึก embedding ตาม hash ของข้อความ
+    (รัน pipeline ซ้ำกับข้อความเดิมไม่ต้องเรียก model ใหม่)
     
     Args:
         text: ข้อความที่ต้องการสร้าง embedding
+        cache_collection: collection ของ embedding cache (ไม่บังคับ)
         
     Returns:
         list: embedding vector (list of floats) หรือ None ถ้าเกิดข้อผิดพลาด
@@ -243,46 +534,316 @@ def create_text_embedding(text):
     if not text or not text.strip():
         return None
     
+    key = embedding_cache_key(text)
+    if cache_collection is not None:
+        try:
+            cached = cache_collection.find_one({"key": key}, {"_id": 0, "embedding": 1})
+            if cached and cached.get("embedding"):
+                return _unpack_cached_embedding(cached["embedding"])
+        except Exception as e:
+            print(f"⚠️ Error reading embedding cache: {e}")
+    
     try:
-        model = get_embedding_model()
-        embedding = model.encode(text, convert_to_numpy=True).tolist()
-        return embedding
+        embedding = list(_encode_text_cached(text))
     except Exception as e:
         print(f"⚠️ Error creating embedding: {e}")
         return None
+    
+    if cache_collection is not None:
+        try:
+            cache_collection.update_one(
+                {"key": key},
+                {"$set": {"embedding": _pack_cached_embedding(embedding), "model": EMBEDDING_MODEL_NAME, "created_at": datetime.now()}},
+                upsert=True
+            )
+        except Exception as e:
+            print(f"⚠️ Error writing embedding cache: {e}")
+    return embedding
+
+# ✅ ฟังก์ชันสร้าง embedding หลายข้อความในครั้งเดียว
+def create_text_embeddings(texts, cache_collection=None):
+    """
+    สร้าง embedding ของหลายข้อความพร้อมกัน: อ่าน cache ด้วย $in ครั้งเดียว
+    แล้วเรียก model.encode แบบ batch เฉพาะข้อความที่ยังไม่มีใน cache
+    
+    Args:
+        texts: list ของข้อความ
+        cache_collection: collection ของ embedding cache (ไม่บังคับ)
+        
+    Returns:
+        list: embedding (list of floats) ตามลำดับ texts หรือ None สำหรับข้อความว่าง/สร้างไม่สำเร็จ
+    """
+    embeddings = [None] * len(texts)
+    
+    # key -> ตำแหน่งของข้อความ (ข้อความซ้ำกันใช้ embedding เดียวกัน)
+    pending = {}
+    for i, text in enumerate(texts):
+        if text and text.strip():
+            pending.setdefault(embedding_cache_key(text), []).append(i)
+    if not pending:
+        return embeddings
+    
+    if cache_collection is not None:
+        try:
+            cursor = cache_collection.find({"key": {"$in": list(pending)}}, {"_id": 0, "key": 1, "embedding": 1})
+            for cached in cursor:
+                if cached.get("embedding"):
+                    embedding = _unpack_cached_embedding(cached["embedding"])
+                    for i in pending.pop(cached["key"], []):
+                        embeddings[i] = embedding
+        except Exception as e:
+            print(f"⚠️ Error reading embedding cache: {e}")
+    
+    if not pending:
+        return embeddings
+    
+    missing_keys = list(pending)
+    try:
+        model = get_embedding_model()
+        vectors = model.encode(
+            [texts[pending[key][0]] for key in missing_keys],
+            batch_size=EMBEDDING_BATCH_SIZE,
+            convert_to_numpy=True,
+            show_progress_bar=False
+        ).tolist()
+    except Exception as e:
+        print(f"⚠️ Error creating embeddings: {e}")
+        return embeddings
+    
+    for key, vector in zip(missing_keys, vectors):
+        for i in pending[key]:
+            embeddings[i] = vector
+    
+    if cache_collection is not None:
+        try:
+            now = datetime.now()
+            cache_collection.bulk_write([
+                UpdateOne(
+                    {"key": key},
+                    {"$set": {"embedding": _pack_cached_embedding(vector), "model": EMBEDDING_MODEL_NAME, "created_at": now}},
+                    upsert=True
+                )
+                for key, vector in zip(missing_keys, vectors)
+            ], ordered=False)
+        except Exception as e:
+            print(f"⚠️ Error writing embedding cache: {e}")
+    return embeddings
+
+# ✅ ฟังก์ชันบีบอัด embedding เป็น int8 ก่อนบันทึกลง MongoDB
+def quantize_embedding(embedding):
+    """
+    แปลง embedding (float) เป็น int8 แบบ symmetric เพื่อลดขนาดที่เก็บและส่งผ่าน network
+    (cosine similarity แทบไม่เปลี่ยน ส่วน scale ใช้แปลงกลับเป็นค่าเดิมโดยประมาณ)
+    
+    Args:
+        embedding: embedding vector (list of floats)
+        
+    Returns:
+        tuple: (Binary vector แบบ int8, scale) โดย embedding ≈ int8 * scale
+    """
+    return quantize_embeddings([embedding])[0]
+
+def quantize_embeddings(embeddings):
+    """
+    quantize_embedding แบบหลาย vector พร้อมกัน (หา scale และปัดเป็น int8 ทั้ง matrix ใน NumPy ครั้งเดียว)
+    
+    Args:
+        embeddings: list ของ embedding vectors ที่มีขนาดเท่ากัน
+        
+    Returns:
+        list: (Binary vector แบบ int8, scale) ของแต่ละ vector ตามลำดับเดิม
+    """
+    if not embeddings:
+        return []
+    matrix = np.asarray(embeddings, dtype=np.float32)
+    if matrix.shape[1] == 0:
+        return [(Binary.from_vector([], BinaryVectorDtype.INT8), 1.0)] * len(matrix)
+    max_abs = np.abs(matrix).max(axis=1).astype(np.float64)
+    scales = np.where(max_abs > 0, max_abs / 127.0, 1.0)
+    quantized = np.round(matrix / scales.astype(np.float32)[:, None]).astype(np.int8)
+    return [
+        (Binary.from_vector(row, BinaryVectorDtype.INT8), scale)
+        for row, scale in zip(quantized.tolist(), scales.tolist())
+    ]
+
+# ✅ ฟังก์ชันใส่ embeddings ให้ทุก chunk
+def attach_embeddings(chunks, cache_collection=None):
+    """
+    สร้าง embeddings จาก text ของทุก chunk ด้วย batch เดียว แล้วใส่กลับเป็น int8 + scale
+    
+    Args:
+        chunks: list ของ chunk (แก้ไขใน list เดิม)
+        cache_collection: collection ของ embedding cache (ไม่บังคับ)
+    """
+    embeddings = create_text_embeddings([chunk.get('text', '') for chunk in chunks], cache_collection=cache_collection)
+    
+    # quantize ทุก embedding ที่สร้างได้ใน matrix เดียว
+    embedded = [(chunk, embedding) for chunk, embedding in zip(chunks, embeddings) if embedding]
+    quantized = quantize_embeddings([embedding for _, embedding in embedded])
+    for (chunk, _), (vector, scale) in zip(embedded, quantized):
+        chunk['embeddings'], chunk['embeddings_scale'] = vector, scale
+    
+    for chunk, embedding in zip(chunks, embeddings):
+        if not embedding and chunk.get('text'):
+            print(f"   ⚠️ ไม่สามารถสร้าง embedding สำหรับ {chunk.get('type', '')} chunk {chunk.get('chunk_id', 'unknown')} ได้")
+
+# ✅ สร้าง index ของ collection ที่เก็บ chunks
+def ensure_chunk_indexes(collection, dimensions=EMBEDDING_DIMENSIONS):
+    """
+    สร้าง index (page, type) และ Atlas Vector Search index บน embeddings
+    เรียกครั้งเดียวหลัง drop collection (drop ลบ index เดิมไปด้วย)
+    Vector Search index มีเฉพาะบน MongoDB Atlas ถ้าสร้างไม่ได้จะข้ามไป
+    ขนาด vector มาจาก config (ไม่ต้องโหลด embedding model แค่เพื่อสร้าง index)
+    """
+    try:
+        collection.create_index([("page", 1), ("type", 1)])
+    except Exception as e:
+        print(f"⚠️ ไม่สามารถสร้าง index (page, type) ของ {collection.name} ได้: {e}")
+        return
+    
+    try:
+        collection.create_search_index(SearchIndexModel(
+            definition={"fields": [{
+                "type": "vector",
+                "path": "embeddings",
+                "numDimensions": dimensions,
+                "similarity": "cosine"  # cosine ไม่ขึ้นกับ embeddings_scale จึงใช้กับ int8 ได้ตรง ๆ
+            }]},
+            name=VECTOR_INDEX_NAME,
+            type="vectorSearch"
+        ))
+    except Exception as e:
+        print(f"⚠️ ไม่สามารถสร้าง Vector Search index ของ {collection.name} ได้ (ต้องใช้ MongoDB Atlas): {e}")
+
+# ✅ บันทึก chunks หลายเอกสารใน request เดียว
+def insert_chunks(collection, chunks):
+    """
+    insert_many แบบ ordered=False (เอกสารที่ error ไม่ทำให้เอกสารอื่นใน batch ล้มเหลว)
+    ด้วย BULK_LOAD_WRITE_CONCERN (ไม่ต้องรอ majority/journal ทุก batch)
+    ถ้ามีบางเอกสาร insert ไม่สำเร็จจะแสดงจำนวนแล้วทำงานต่อ แทนการยกเลิกทั้ง batch
+    ถ้าการเชื่อมต่อขัดข้องชั่วคราว (AutoReconnect เช่น not primary, network timeout) จะลองใหม่
+    สูงสุด INSERT_RETRIES ครั้ง (insert_many ใส่ _id ให้เอกสารแล้ว การลองใหม่จึงไม่ทำให้ข้อมูลซ้ำ)
+    
+    Returns:
+        int: จำนวนเอกสารที่บันทึกสำเร็จ
+    """
+    if not chunks:
+        return 0
+    bulk_collection = collection.with_options(write_concern=BULK_LOAD_WRITE_CONCERN)
+    for attempt in range(INSERT_RETRIES + 1):
+        try:
+            return len(bulk_collection.insert_many(chunks, ordered=False).inserted_ids)
+        except AutoReconnect as e:
+            if attempt == INSERT_RETRIES:
+                raise
+            delay = 2 ** attempt
+            print(f"   ⚠️ การเชื่อมต่อขัดข้องระหว่าง insert ลง {collection.name} ({e}) ลองใหม่ใน {delay} วินาที...")
+            time.sleep(delay)
+        except BulkWriteError as e:
+            # ตอนลองใหม่ เอกสารที่ insert สำเร็จไปแล้วในรอบก่อนจะได้ duplicate key error (_id เดิม) ถือว่าสำเร็จ
+            write_errors = [
+                error for error in e.details.get('writeErrors', [])
+                if not (attempt > 0 and error.get('code') == 11000)
+            ]
+            inserted = len(chunks) - len(write_errors)
+            if write_errors:
+                print(f"   ⚠️ insert ลง {collection.name} ไม่สำเร็จ {len(write_errors)} เอกสาร (สำเร็จ {inserted})")
+                print(f"      - ตัวอย่าง error: {write_errors[0].get('errmsg')}")
+            return inserted
+
+# ✅ ย้ายไฟล์รูปจาก chunk ไปเก็บใน GridFS
+def get_image_bucket(db, drop=False):
+    """
+    คืน GridFS bucket สำหรับเก็บไฟล์รูปต้นฉบับ
+    drop=True จะลบไฟล์รูปเก่าทั้งหมดก่อน (ใช้ตอนรัน pipeline ใหม่)
+    """
+    if drop:
+        db[f"{ORIGINAL_IMAGE_BUCKET}.files"].drop()
+        db[f"{ORIGINAL_IMAGE_BUCKET}.chunks"].drop()
+    return gridfs.GridFS(db, collection=ORIGINAL_IMAGE_BUCKET)
+
+def store_chunk_images(chunks, fs):
+    """
+    ย้าย image_bytes ของแต่ละ chunk ไปเก็บใน GridFS แล้วเก็บแค่ image_id ไว้ใน chunk
+    (เอกสารใน collection จึงเล็กลงมากและไม่ติด limit 16MB ต่อเอกสาร)
+    """
+    for chunk in chunks:
+        image_bytes = chunk.pop("image_bytes", None)
+        if image_bytes is not None:
+            chunk["image_id"] = fs.put(image_bytes, filename=f"p{chunk.get('page')}_i{chunk.get('image_index')}")
 
 # ✅ อ่านข้อความจาก PDF ด้วย PyMuPDF
-def extract_text_with_pymupdf(path):
+def extract_text_with_pymupdf(path, doc=None):
     """
     อ่านข้อความจาก PDF ด้วย PyMuPDF
+    ส่ง doc (fitz.Document ที่เปิดไว้แล้ว) มาเพื่อใช้ร่วมกับ extract_images_with_ocr โดยไม่ต้อง parse ไฟล์ซ้ำ
     """
     print(f"📖 กำลังอ่านข้อความจาก: {path}")
-    text_output = ""
-    doc = fitz.open(path)
+    text_parts = []  # เก็บเป็น list แล้ว join ตอนท้าย (ไม่ต้อง copy string ใหม่ทุกหน้า)
+    owns_doc = doc is None
+    if owns_doc:
+        doc = fitz.open(path)
     
     try:
         for page_num, page in enumerate(doc):
             page_text = page.get_text("text")
             if page_text.strip():
-                text_output += f"\n--- หน้า {page_num + 1} ---\n{page_text}"
+                text_parts.append(f"\n--- หน้า {page_num + 1} ---\n{page_text}")
             
             # ตรวจสอบ memory ทุก 20 หน้า
             if page_num % 20 == 0:
                 check_memory()
                 
     finally:
-        doc.close()
+        if owns_doc:
+            doc.close()
     
-    return text_output
+    return "".join(text_parts)
 
 # ✅ แปลงรูปภาพเป็นข้อความด้วย OCR + PyThaiNLP (ปรับปรุง memory management)
-def extract_images_with_ocr(path):
+def extract_images_with_ocr(path, doc=None):
     """
     แปลงรูปภาพใน PDF เป็นข้อความด้วย OCR + PyThaiNLP
+    ส่ง doc (fitz.Document ที่เปิดไว้แล้ว) มาเพื่อไม่ต้องเปิดไฟล์ใหม่ (ผู้เรียกเป็นคนปิดเอง)
+    
+    เป็น generator: yield ข้อมูลรูปทีละรูปหลัง OCR แต่ละ batch เสร็จ
+    (ผู้เรียกบันทึกไปได้เลย ไม่ต้องเก็บรูปทั้งไฟล์ไว้ใน memory พร้อมกัน)
     """
     print(f"🖼️ กำลังแปลงรูปภาพเป็นข้อความจาก: {path}")
-    images_data = []
-    doc = fitz.open(path)
+    images_accepted = 0  # นับรูปที่ผ่านการกรองแล้ว (นับตอนเข้า pending) สำหรับจำกัด 50 รูป
+    pending = []  # รูปที่ผ่านการกรองขนาดแล้ว รอทำ OCR แบบ batch: (page_num, img_index, image_bytes, width, height)
+    owns_doc = doc is None
+    if owns_doc:
+        doc = fitz.open(path)
+    
+    def flush_pending():
+        """ทำ OCR รูปที่รออยู่ทั้งหมดในครั้งเดียว คืน list ข้อมูลรูปที่มีข้อความ"""
+        if not pending:
+            return []
+        try:
+            ocr_results = perform_ocr_on_images_batched([(image_bytes, width, height) for _, _, image_bytes, width, height in pending])
+        except Exception as e:
+            print(f"❗ Error processing OCR batch ({len(pending)} รูป): {e}")
+            ocr_results = [("", "")] * len(pending)
+        
+        results = []
+        for (page_num, img_index, image_bytes, _, _), (original_text, improved_text) in zip(pending, ocr_results):
+            if improved_text.strip():
+                image_info = {
+                    "page": page_num + 1,
+                    "image_index": img_index + 1,
+                    "original_text": original_text,
+                    "improved_text": improved_text,
+                    "text": improved_text,  # ใช้ข้อความที่ปรับปรุงแล้ว
+                    "image_bytes": image_bytes  # bytes ดิบ ย้ายไป GridFS ตอนบันทึก
+                }
+                results.append(image_info)
+                
+                print(f"✅ รูป {img_index + 1} หน้า {page_num + 1}: {len(improved_text)} ตัวอักษร (OCR: {len(original_text)} ตัวอักษร)")
+        
+        # ล้าง memory
+        pending.clear()
+        return results
     
     try:
         for page_num, page in enumerate(doc):
@@ -291,13 +852,9 @@ def extract_images_with_ocr(path):
             
             for img_index, img in enumerate(images):
                 try:
-                    xref = img[0]
-                    base_image = doc.extract_image(xref)
-                    image_bytes = base_image["image"]
-                    
-                    # ตรวจสอบขนาดรูปภาพ
-                    image = Image.open(io.BytesIO(image_bytes))
-                    width, height = image.size
+                    # ตรวจสอบขนาดรูปภาพจาก get_images (full=True ให้ width, height มาแล้ว)
+                    # ก่อน extract เพื่อไม่ต้องดึง bytes ของรูปที่จะถูกข้าม
+                    xref, width, height = img[0], img[2], img[3]
                     
                     # ข้ามรูปที่ใหญ่เกินไป
                     if width * height > 1500000:  # 1.5M pixels
@@ -309,75 +866,236 @@ def extract_images_with_ocr(path):
                         print(f"⚠️ ข้ามรูปเล็ก {img_index + 1} ({width}x{height})")
                         continue
                     
-                    # OCR (ใช้ Typhoon OCR) และปรับปรุงข้อความด้วย PyThaiNLP
-                    original_text, improved_text = perform_ocr_on_image_bytes(image_bytes)
+                    image_bytes = doc.extract_image(xref)["image"]
                     
-                    if improved_text.strip():
-                        image_info = {
-                            "page": page_num + 1,
-                            "image_index": img_index + 1,
-                            "original_text": original_text,
-                            "improved_text": improved_text,
-                            "text": improved_text,  # ใช้ข้อความที่ปรับปรุงแล้ว
-                            "image_base64": base64.b64encode(image_bytes).decode("utf-8")
-                        }
-                        images_data.append(image_info)
-                        
-                        print(f"✅ รูป {img_index + 1}: {len(improved_text)} ตัวอักษร (OCR: {len(original_text)} ตัวอักษร)")
+                    pending.append((page_num, img_index, image_bytes, width, height))
+                    images_accepted += 1
                     
-                    # ล้าง memory
-                    del image, image_bytes
+                    # จำกัดไม่เกิน 50 รูป
+                    if images_accepted >= 50:
+                        break
                     
                 except Exception as e:
                     print(f"❗ Error processing image {img_index + 1} on page {page_num + 1}: {e}")
                     continue
             
+            # OCR แบบ batch เมื่อรูปที่รออยู่ครบหนึ่ง batch
+            if len(pending) >= OCR_BATCH_SIZE:
+                yield from flush_pending()
+            
             # ตรวจสอบ memory หลังจากประมวลผลแต่ละหน้า
             if page_num % 5 == 0:
                 check_memory()
             
-            # จำกัดจำนวนรูปต่อหน้า
-            if len(images_data) > 50:  # จำกัดไม่เกิน 50 รูป
+            # จำกัดจำนวนรูปทั้งไฟล์
+            if images_accepted >= 50:
                 print("⚠️ จำกัดจำนวนรูปที่ 50 รูป")
                 break
+        
+        # OCR รูปที่เหลือ (รูปที่รับเข้า pending แล้วต้องทำ OCR เสมอ)
+        yield from flush_pending()
                 
     finally:
-        doc.close()
+        if owns_doc:
+            doc.close()
+
+# ✅ แปลงตาราง (list ของแถว) เป็นข้อความ
+def table_to_text(table):
+    """
+    แปลงตารางจาก pdfplumber เป็นข้อความ แถวละบรรทัด คั่น cell ด้วย " | " (ข้ามแถวว่าง)
+    ใช้ join ครั้งเดียวแทนการต่อ string ทีละแถว
+    """
+    return "".join(
+        " | ".join([cell if cell else "" for cell in row]) + "\n"
+        for row in table if row
+    )
+
+# ✅ เกณฑ์การรวม text blocks (STEP 2.5 ใน process_single_page)
+TEXT_MERGE_Y_THRESHOLD = 50  # y_pos ห่างกันไม่เกินนี้ถือว่าอยู่ย่อหน้าเดียวกัน
+TEXT_MERGE_SHORT_LENGTH = 100  # block/chunk ที่สั้นกว่านี้ถือว่าสั้นมาก
+TEXT_MERGE_SHORT_Y_THRESHOLD = 100  # block/chunk ที่สั้นมากรวมกับตัวที่ห่างไม่เกินนี้ได้
+TEXT_MERGE_MAX_LENGTH = 2000  # ขนาดสูงสุดของ chunk (ตัวอักษร)
+
+@njit(cache=True)
+def _assign_text_groups(ys, lens, y_threshold, short_length, short_y_threshold, max_length):
+    """
+    คำนวณว่า text block แต่ละอันจะถูกรวมอยู่ใน chunk ไหน (ทำงานกับ array ตัวเลขอย่างเดียว)
     
-    return images_data
+    รอบที่ 1: รวม block ที่ y_pos ใกล้กัน (หรือ block สั้นมากที่ห่างไม่เกิน short_y_threshold)
+    ตราบที่ความยาวหลัง " ".join ไม่เกิน max_length
+    รอบที่ 2: chunk ที่สั้นมากรวมกับ chunk ถัดไปหนึ่งอัน ถ้าอยู่ใกล้กันและรวมแล้วไม่เกิน max_length
+    
+    Returns:
+        tuple: (group id ของแต่ละ block, index ของ block ที่ใช้เป็น y_pos ของแต่ละ chunk)
+    """
+    n = ys.shape[0]
+    first_groups = np.empty(n, np.int32)
+    group_len = np.empty(n, np.int64)
+    group_y = np.empty(n, np.float64)
+    group_y_idx = np.empty(n, np.int32)
+    
+    # รอบที่ 1 (y_pos ของ chunk คือของ block ล่าสุดที่รวมเข้าไป)
+    g = -1
+    for i in range(n):
+        merge = False
+        if g >= 0:
+            distance = abs(ys[i] - group_y[g])
+            if distance <= y_threshold:
+                merge = True
+            elif lens[i] < short_length and distance <= short_y_threshold:
+                merge = True
+        if merge and group_len[g] + 1 + lens[i] <= max_length:
+            group_len[g] += 1 + lens[i]
+        else:
+            g += 1
+            group_len[g] = lens[i]
+        group_y[g] = ys[i]
+        group_y_idx[g] = i
+        first_groups[i] = g
+    
+    # รอบที่ 2 (chunk ที่รวมแล้วใช้ y_pos ของ chunk แรก และไม่ถูกรวมต่ออีก)
+    n_groups = g + 1
+    final_ids = np.empty(n_groups, np.int32)
+    final_y_idx = np.empty(n_groups, np.int32)
+    f = -1
+    k = 0
+    while k < n_groups:
+        f += 1
+        final_ids[k] = f
+        final_y_idx[f] = group_y_idx[k]
+        if (group_len[k] < short_length and k + 1 < n_groups
+                and abs(group_y[k + 1] - group_y[k]) <= short_y_threshold
+                and group_len[k] + 1 + group_len[k + 1] <= max_length):
+            final_ids[k + 1] = f
+            k += 2
+        else:
+            k += 1
+    
+    groups = np.empty(n, np.int32)
+    for i in range(n):
+        groups[i] = final_ids[first_groups[i]]
+    return groups, final_y_idx[:f + 1]
+
+def _assign_text_groups_list(ys, lens, y_threshold, short_length, short_y_threshold, max_length):
+    """
+    _assign_text_groups แบบ list ของ Python ใช้เมื่อไม่มี numba
+    (ถ้าไม่ได้ compile การอ่าน/เขียน numpy array ทีละ element ช้ากว่า list หลายเท่า)
+    
+    Returns:
+        tuple: (list group id ของแต่ละ block, list index ของ block ที่ใช้เป็น y_pos ของแต่ละ chunk)
+    """
+    first_groups = []
+    group_len = []
+    group_y = []
+    group_y_idx = []
+    
+    # รอบที่ 1 (y_pos ของ chunk คือของ block ล่าสุดที่รวมเข้าไป)
+    for i, (y, length) in enumerate(zip(ys, lens)):
+        if group_len:
+            distance = abs(y - group_y[-1])
+            merge = distance <= y_threshold or (length < short_length and distance <= short_y_threshold)
+            if merge and group_len[-1] + 1 + length <= max_length:
+                group_len[-1] += 1 + length
+                group_y[-1] = y
+                group_y_idx[-1] = i
+                first_groups.append(len(group_len) - 1)
+                continue
+        group_len.append(length)
+        group_y.append(y)
+        group_y_idx.append(i)
+        first_groups.append(len(group_len) - 1)
+    
+    # รอบที่ 2 (chunk ที่รวมแล้วใช้ y_pos ของ chunk แรก และไม่ถูกรวมต่ออีก)
+    n_groups = len(group_len)
+    final_ids = [0] * n_groups
+    final_y_idx = []
+    k = 0
+    while k < n_groups:
+        f = len(final_y_idx)
+        final_ids[k] = f
+        final_y_idx.append(group_y_idx[k])
+        if (group_len[k] < short_length and k + 1 < n_groups
+                and abs(group_y[k + 1] - group_y[k]) <= short_y_threshold
+                and group_len[k] + 1 + group_len[k + 1] <= max_length):
+            final_ids[k + 1] = f
+            k += 2
+        else:
+            k += 1
+    
+    return [final_ids[g] for g in first_groups], final_y_idx
+
+def merge_text_elements(text_elements):
+    """
+    รวม text blocks ที่อยู่ใกล้กันเป็น chunks (ตัดสินใจด้วย _assign_text_groups แล้วต่อ string ครั้งเดียว)
+    
+    Returns:
+        list: chunks แบบ {'text', 'y_pos', 'bbox'} เรียงตามลำดับ block เดิม
+    """
+    ys = [float(e['y_pos']) for e in text_elements]
+    lens = [len(e['data']['text'] or "") for e in text_elements]
+    thresholds = (TEXT_MERGE_Y_THRESHOLD, TEXT_MERGE_SHORT_LENGTH,
+                  TEXT_MERGE_SHORT_Y_THRESHOLD, TEXT_MERGE_MAX_LENGTH)
+    if NUMBA_AVAILABLE:
+        groups, y_idx = _assign_text_groups(np.array(ys, dtype=np.float64), np.array(lens, dtype=np.int64), *thresholds)
+        groups = groups.tolist()
+    else:
+        groups, y_idx = _assign_text_groups_list(ys, lens, *thresholds)
+    
+    merged_chunks = []
+    for group_id, members in itertools.groupby(zip(groups, text_elements), key=itemgetter(0)):
+        blocks = [e for _, e in members]
+        merged_chunks.append({
+            'text': " ".join(e['data']['text'] for e in blocks),
+            'y_pos': text_elements[y_idx[group_id]]['y_pos'],
+            'bbox': next((e['data'].get('bbox') for e in blocks if e['data'].get('bbox') is not None), None)
+        })
+    return merged_chunks
 
 # ✅ แปลงตารางเป็นข้อความด้วย pdfplumber
-def extract_tables_with_pdfplumber(path):
+def extract_tables_with_pdfplumber(path, pdf=None, pages=None):
     """
     แปลงตารางใน PDF เป็นข้อความด้วย pdfplumber
+    ส่ง pdf (pdfplumber.PDF ที่เปิดไว้แล้ว) มาเพื่อไม่ต้องเปิดไฟล์ใหม่ (ผู้เรียกเป็นคนปิดเอง)
+    ส่ง pages (list ของหมายเลขหน้าแบบ 1-based) มาเพื่อประมวลผลเฉพาะหน้าเหล่านั้น (None = ทุกหน้า)
     """
     print(f"📊 กำลังแปลงตารางเป็นข้อความจาก: {path}")
     tables_data = []
+    owns_pdf = pdf is None
     
     try:
-        with pdfplumber.open(path) as pdf:
-            for page_num, page in enumerate(pdf.pages):
+        if owns_pdf:
+            # pdfplumber สร้าง Page object เฉพาะหน้าที่ระบุใน pages
+            pdf = pdfplumber.open(path, pages=pages)
+            selected_pages = pdf.pages
+        elif pages is not None:
+            selected_pages = [pdf.pages[p - 1] for p in pages]
+        else:
+            selected_pages = pdf.pages
+        try:
+            for page_num, page in enumerate(selected_pages):
                 tables = page.extract_tables()
                 for table_index, table in enumerate(tables):
                     if table:
                         # แปลงตารางเป็นข้อความ
-                        table_text = ""
-                        for row in table:
-                            if row:
-                                row_text = " | ".join([cell if cell else "" for cell in row])
-                                table_text += row_text + "\n"
+                        table_text = table_to_text(table)
                         
                         if table_text.strip():
                             table_info = {
-                                "page": page_num + 1,
+                                "page": page.page_number,
                                 "table_index": table_index + 1,
                                 "text": table_text.strip()
                             }
                             tables_data.append(table_info)
                 
+                # ปล่อย objects/layout ที่ pdfplumber cache ไว้ในหน้านี้ (ไม่งั้นสะสมจนครบทุกหน้า)
+                page.close()
+                
                 # ตรวจสอบ memory ทุก 10 หน้า
                 if page_num % 10 == 0:
                     check_memory()
+        finally:
+            if owns_pdf:
+                pdf.close()
                     
     except Exception as e:
         print(f"❗ Error extracting tables: {e}")
@@ -389,11 +1107,17 @@ def store_original_data_in_mongodb(chunks, collection_name):
     """
     บันทึกข้อมูลต้นฉบับลง ORIGINAL_DB_NAME
     🆕 เพิ่มการสร้าง embeddings ก่อนบันทึก
+    
+    chunks เป็น iterable ใดก็ได้ (เช่น generator จาก extract_images_with_ocr)
+    จะดึงมาทีละ STORE_BATCH_SIZE chunks แล้วสร้าง embeddings + บันทึกทีละ batch
     """
+    chunks = iter(chunks)
+    batch = []
+    stored = 0
     try:
         # ลองเชื่อมต่อ MongoDB Atlas
         print(f"🔗 กำลังเชื่อมต่อ MongoDB Atlas...")
-        client = MongoClient(MONGO_URL, serverSelectionTimeoutMS=5000)
+        client = MongoClient(MONGO_URL, serverSelectionTimeoutMS=5000, compressors=MONGO_COMPRESSORS)
         
         # ทดสอบการเชื่อมต่อ
         client.admin.command('ping')
@@ -405,43 +1129,47 @@ def store_original_data_in_mongodb(chunks, collection_name):
         
         db = client[db_name]
         collection = db[collection_name]
+        embed_cache = get_embed_cache_collection(client)
+        image_fs = None
         
-        # ลบข้อมูลเก่า
-        collection.delete_many({})
+        # ลบข้อมูลเก่า (drop เป็นการลบ metadata ครั้งเดียว ไม่ต้องลบทีละเอกสาร)
+        collection.drop()
+        ensure_chunk_indexes(collection)
         
-        # บันทึกข้อมูลต้นฉบับ
-        print(f"🔄 กำลังสร้าง embeddings สำหรับ {len(chunks)} chunks...")
-        for i, chunk in enumerate(chunks):
-            print(f"📝 กำลังบันทึกข้อมูลต้นฉบับ chunk {i+1}/{len(chunks)}...")
+        while True:
+            batch = list(itertools.islice(chunks, STORE_BATCH_SIZE))
+            if not batch:
+                break
             
-            # สร้างสำเนาของ chunk และเพิ่ม created_at
-            original_chunk = chunk.copy()
-            original_chunk["created_at"] = datetime.now()
+            # สร้างสำเนาของ chunk และเพิ่ม created_at (chunk เดิมไม่ถูกแก้ ใช้เป็น fallback ได้)
+            now = datetime.now()
+            original_chunks = [dict(chunk, created_at=now) for chunk in batch]
             
-            # 🆕 สร้าง embedding จาก text
-            text_content = original_chunk.get('text', '')
-            if text_content:
-                embedding = create_text_embedding(text_content)
-                if embedding:
-                    original_chunk['embeddings'] = embedding
-                else:
-                    print(f"   ⚠️ ไม่สามารถสร้าง embedding สำหรับ chunk {i+1} ได้")
+            # 🆕 สร้าง embedding จาก text ของทุก chunk ใน batch ในครั้งเดียว
+            print(f"🔄 กำลังสร้าง embeddings สำหรับ {len(original_chunks)} chunks...")
+            attach_embeddings(original_chunks, cache_collection=embed_cache)
             
-            collection.insert_one(original_chunk)
+            # ย้ายไฟล์รูป (ถ้ามี) ไปเก็บใน GridFS
+            if any("image_bytes" in chunk for chunk in original_chunks):
+                if image_fs is None:
+                    image_fs = get_image_bucket(db, drop=True)
+                store_chunk_images(original_chunks, image_fs)
             
-            # ตรวจสอบ memory ทุก 5 chunks
-            if i % 5 == 0:
-                check_memory()
+            # บันทึกทั้ง batch ใน request เดียว
+            print(f"📝 กำลังบันทึกข้อมูลต้นฉบับ {len(original_chunks)} chunks...")
+            stored += insert_chunks(collection, original_chunks)
+            batch = []
+            check_memory()
         
-        print(f"✅ บันทึกข้อมูลต้นฉบับ {len(chunks)} chunks ลง {collection_name} (พร้อม embeddings)")
+        print(f"✅ บันทึกข้อมูลต้นฉบับ {stored} chunks ลง {collection_name} (พร้อม embeddings)")
         client.close()
         
     except Exception as e:
         print(f"❗ MongoDB Atlas connection failed: {e}")
         print(f"💾 บันทึกลงไฟล์ JSON แทน...")
         
-        # Fallback: บันทึกลงไฟล์ JSON
-        store_original_to_json(chunks, collection_name)
+        # Fallback: บันทึก chunks ที่ยังไม่ได้ลง MongoDB ลงไฟล์ JSON
+        store_original_to_json(list(itertools.chain(batch, chunks)), collection_name)
 
 # ✅ บันทึกข้อมูลต้นฉบับลงไฟล์ JSON (fallback)
 def store_original_to_json(chunks, collection_name):
@@ -455,19 +1183,20 @@ def store_original_to_json(chunks, collection_name):
             os.makedirs(output_dir)
         
         # บันทึกข้อมูลต้นฉบับ
+        print(f"📝 กำลังบันทึกข้อมูลต้นฉบับ {len(chunks)} chunks...")
+        created_at = datetime.now().isoformat()
         original_chunks = []
-        for i, chunk in enumerate(chunks):
-            print(f"📝 กำลังบันทึกข้อมูลต้นฉบับ chunk {i+1}/{len(chunks)}...")
-            
+        for chunk in chunks:
             # สร้างสำเนาของ chunk และเพิ่ม created_at
             original_chunk = chunk.copy()
-            original_chunk["created_at"] = datetime.now().isoformat()
+            original_chunk["created_at"] = created_at
             
-            original_chunks.append(original_chunk)
+            # bytes เขียนเป็น JSON ไม่ได้ แปลงรูปเป็น base64 เฉพาะตอนเขียนไฟล์
+            if "image_bytes" in original_chunk:
+                original_chunk["image_base64"] = base64.b64encode(original_chunk.pop("image_bytes")).decode("utf-8")
             
-            # ตรวจสอบ memory ทุก 5 chunks
-            if i % 5 == 0:
-                check_memory()
+            original_chunks.append(original_chunk)
+        check_memory()
         
         # บันทึกลงไฟล์
         filename = f"{output_dir}/{collection_name}_original.json"
@@ -516,69 +1245,67 @@ def process_single_page(page_num, pymupdf_page, pdfplumber_pdf, doc_id_counter):
         
         # 1.1 ดึง Text Blocks พร้อมตำแหน่ง
         text_blocks = pymupdf_page.get_text("blocks")  # Returns: [(x0, y0, x1, y1, text, block_no, block_type), ...]
-        for block in text_blocks:
-            if block[6] == 0:  # block_type = 0 คือ text block
-                x0, y0, x1, y1, text, block_no, block_type = block
-                if text.strip():
-                    elements.append({
-                        'type': 'text',
-                        'y_pos': y0,  # ใช้ y0 (ตำแหน่งบนสุด) สำหรับเรียงลำดับ
-                        'data': {
-                            'text': text.strip(),
-                            'bbox': (x0, y0, x1, y1),
-                            'block_no': block_no
-                        }
-                    })
+        # block_type = 0 คือ text block (strip ครั้งเดียวแล้วใช้ทั้งตรวจและเก็บ)
+        elements.extend(
+            {
+                'type': 'text',
+                'y_pos': y0,  # ใช้ y0 (ตำแหน่งบนสุด) สำหรับเรียงลำดับ
+                'data': {
+                    'text': stripped_text,
+                    'bbox': (x0, y0, x1, y1),
+                    'block_no': block_no
+                }
+            }
+            for x0, y0, x1, y1, text, block_no, block_type in text_blocks
+            if block_type == 0 and (stripped_text := text.strip())
+        )
         
         # 1.2 ดึง Images พร้อมตำแหน่ง
         images = pymupdf_page.get_images(full=True)
         if images:
             print(f"   🖼️ พบ {len(images)} รูปภาพในหน้านี้")
+            
+            # ดึงตำแหน่งของทุกรูปในหน้าด้วย get_image_info ครั้งเดียว (xref -> bbox แรกที่เจอ)
+            # แทนการเรียก get_image_rects ทีละรูป ซึ่ง scan รูปทั้งหน้าใหม่ทุกครั้ง
+            try:
+                image_bboxes = {}
+                for info in pymupdf_page.get_image_info(xrefs=True):
+                    image_bboxes.setdefault(info['xref'], info['bbox'])
+            except Exception as e:
+                print(f"⚠️ ไม่สามารถดึงตำแหน่งรูปภาพในหน้านี้ได้: {e}")
+                image_bboxes = None
         
+        # ตำแหน่งรูปดึงไว้แล้วทั้งหน้า ในลูปจึงเป็นแค่การ lookup (ไม่มีอะไร raise ไม่ต้อง try ทีละรูป)
         for img_index, img in enumerate(images):
             xref = img[0]
-            try:
-                # พยายามหา bbox ของรูปภาพจาก get_image_rects
-                y_pos = 0  # ค่าเริ่มต้น
+            if image_bboxes is None:
+                # ถ้าไม่สามารถดึงตำแหน่งได้ ให้ประมาณจาก image list position
+                # (รูปแรกจะอยู่ตำแหน่งบนสุดกว่า)
                 bbox = None
-                try:
-                    from pymupdf.utils import get_image_rects
-                    image_rects = get_image_rects(pymupdf_page, xref)
-                    if image_rects:
-                        bbox = image_rects[0]  # ใช้ rect แรก
-                        if hasattr(bbox, 'y0'):
-                            y_pos = bbox.y0
-                        elif isinstance(bbox, (list, tuple)) and len(bbox) >= 4:
-                            y_pos = bbox[1]  # y0
-                except Exception as rect_error:
-                    # ถ้าไม่สามารถดึงตำแหน่งได้ ให้ประมาณจาก image list position
-                    # (รูปแรกจะอยู่ตำแหน่งบนสุดกว่า)
-                    y_pos = img_index * 100  # ประมาณตำแหน่ง
-                
-                elements.append({
-                    'type': 'image',
-                    'y_pos': y_pos,
-                    'data': {
-                        'xref': xref,
-                        'image_index': img_index,
-                        'bbox': bbox
-                    }
-                })
-            except Exception as e:
-                print(f"⚠️ ไม่สามารถดึงตำแหน่งรูป {img_index + 1} ได้: {e}")
-                # ถ้าไม่สามารถดึงตำแหน่งได้ ให้ใส่ตำแหน่ง 0 (จะอยู่แรกสุด)
-                elements.append({
-                    'type': 'image',
-                    'y_pos': img_index * 100,  # ประมาณตำแหน่ง
-                    'data': {
-                        'xref': xref,
-                        'image_index': img_index,
-                        'bbox': None
-                    }
-                })
+                y_pos = img_index * 100  # ประมาณตำแหน่ง
+            else:
+                bbox = image_bboxes.get(xref)
+                y_pos = bbox[1] if bbox else 0  # y0
+            
+            elements.append({
+                'type': 'image',
+                'y_pos': y_pos,
+                'data': {
+                    'xref': xref,
+                    'image_index': img_index,
+                    'width': img[2],
+                    'height': img[3],
+                    'bbox': bbox
+                }
+            })
         
         # 1.3 ดึง Tables พร้อมตำแหน่ง (จาก pdfplumber)
-        if page_num < len(pdfplumber_pdf.pages):
+        # find_tables หาตารางจากเส้นและกรอบในหน้า ถ้าหน้านี้ไม่มี vector drawing เลย (เช่นหน้าสแกน)
+        # ก็ไม่มีตารางให้เจอ จึงข้ามการ parse หน้าด้วย pdfplumber ไปเลย (get_cdrawings ของ PyMuPDF เร็วกว่ามาก)
+        has_drawings = bool(pymupdf_page.get_cdrawings())
+        if not has_drawings:
+            print("   📊 ไม่มีเส้นหรือกรอบในหน้านี้ ข้ามการหาตาราง")
+        elif page_num < len(pdfplumber_pdf.pages):
             pdfplumber_page = pdfplumber_pdf.pages[page_num]
             
             # พยายามหา bbox ของตาราง
@@ -594,12 +1321,7 @@ def process_single_page(page_num, pymupdf_page, pdfplumber_pdf, doc_id_counter):
                             
                             # แปลงตารางเป็นข้อความ
                             table = table_obj.extract() if hasattr(table_obj, 'extract') else None
-                            table_text = ""
-                            if table:
-                                for row in table:
-                                    if row:
-                                        row_text = " | ".join([cell if cell else "" for cell in row])
-                                        table_text += row_text + "\n"
+                            table_text = table_to_text(table) if table else ""
                             
                             if table_text.strip():
                                 elements.append({
@@ -619,16 +1341,11 @@ def process_single_page(page_num, pymupdf_page, pdfplumber_pdf, doc_id_counter):
                 tables = pdfplumber_page.extract_tables()
                 
                 # ประมาณตำแหน่งตารางจากตำแหน่งของ text และ image elements ที่มีอยู่
-                existing_y_positions = [e['y_pos'] for e in elements]
-                base_y_pos = max(existing_y_positions) if existing_y_positions else 500  # เริ่มที่ 500 ถ้าไม่มี elements อื่น
+                base_y_pos = max((e['y_pos'] for e in elements), default=500)  # เริ่มที่ 500 ถ้าไม่มี elements อื่น
                 
                 for table_index, table in enumerate(tables):
                     if table:
-                        table_text = ""
-                        for row in table:
-                            if row:
-                                row_text = " | ".join([cell if cell else "" for cell in row])
-                                table_text += row_text + "\n"
+                        table_text = table_to_text(table)
                         
                         if table_text.strip():
                             # ประมาณตำแหน่งตาราง (ถัดจาก elements อื่นๆ)
@@ -642,130 +1359,33 @@ def process_single_page(page_num, pymupdf_page, pdfplumber_pdf, doc_id_counter):
                                     'bbox': None
                                 }
                             })
+            finally:
+                # ปล่อย objects/layout ที่ pdfplumber cache ไว้ในหน้านี้
+                # (worker เปิดไฟล์ค้างไว้ใช้หลายหน้า ถ้าไม่ล้าง cache จะสะสมจนครบทุกหน้า)
+                pdfplumber_page.close()
         
         # === STEP 2: เรียงลำดับ elements ตาม y-coordinate (จากบนลงล่าง) ===
-        elements.sort(key=lambda x: x['y_pos'])
+        elements.sort(key=itemgetter('y_pos'))
         
-        print(f"📊 พบ {len(elements)} elements: {len([e for e in elements if e['type']=='text'])} text, "
-              f"{len([e for e in elements if e['type']=='image'])} images, "
-              f"{len([e for e in elements if e['type']=='table'])} tables")
+        # นับจำนวนแต่ละประเภทในรอบเดียว
+        type_counts = Counter(e['type'] for e in elements)
+        print(f"📊 พบ {len(elements)} elements: {type_counts['text']} text, "
+              f"{type_counts['image']} images, "
+              f"{type_counts['table']} tables")
         
         # === STEP 2.5: รวม text blocks ที่อยู่ใกล้กัน (ในบรรทัดเดียวกันหรือใกล้กัน) ===
         # 🆕 เพื่อแก้ปัญหาที่ text blocks ถูกแบ่งเป็น chunks เล็กเกินไป
         text_elements = [e for e in elements if e['type'] == 'text']
-        if text_elements:
+        if len(text_elements) == 1:
+            # มี text block เดียว ไม่มีอะไรให้รวม: เปลี่ยนเป็น text_merged ในที่เดิม (elements เรียงอยู่แล้ว)
+            text_elem = text_elements[0]
+            text_elem['type'] = 'text_merged'
+            text_elem['data'] = {'text': text_elem['data']['text'], 'bbox': text_elem['data'].get('bbox')}
+        elif text_elements:
             # 🆕 กลยุทธ์การรวม: รวม text blocks ที่อยู่ใกล้กันมากขึ้น
             # ใช้ threshold ที่ใหญ่ขึ้น (50 pixels) และรวม chunks ที่สั้นมาก (< 100 ตัวอักษร) เข้าด้วยกัน
-            merged_text_chunks = []
-            current_chunk_texts = []
-            current_chunk_y_pos = None
-            current_chunk_bbox = None
-            Y_POS_THRESHOLD = 50  # 🆕 เพิ่มจาก 20 เป็น 50 pixels เพื่อรวม chunks ที่อยู่ห่างกันมากขึ้น
-            MAX_CHUNK_LENGTH = 2000  # 🆕 กำหนดขนาดสูงสุดของ chunk (2000 ตัวอักษร) เพื่อป้องกัน chunks ใหญ่เกินไป
-            
-            for text_elem in text_elements:
-                y_pos = text_elem['y_pos']
-                text_content = text_elem['data']['text']
-                bbox = text_elem['data'].get('bbox')
-                text_length = len(text_content) if text_content else 0
-                
-                # 🆕 ถ้า chunk สั้นมาก (< 100 ตัวอักษร) ให้รวมกับ chunk ก่อนหน้าเสมอ (ถ้ามี)
-                # หรือถ้า y_pos ใกล้กับ block ก่อนหน้า ให้รวมกัน
-                should_merge = False
-                if current_chunk_y_pos is None:
-                    should_merge = True  # block แรก
-                elif abs(y_pos - current_chunk_y_pos) <= Y_POS_THRESHOLD:
-                    should_merge = True  # y_pos ใกล้กัน
-                elif text_length < 100:
-                    # 🆕 ถ้า chunk สั้นมาก ให้รวมกับ chunk ก่อนหน้า (แม้ y_pos จะห่างกัน)
-                    # แต่ต้องไม่ห่างเกินไป (ภายใน 100 pixels)
-                    if abs(y_pos - current_chunk_y_pos) <= 100:
-                        should_merge = True
-                
-                if should_merge:
-                    # 🆕 ตรวจสอบว่าถ้ารวม text นี้เข้าไปแล้ว chunk จะใหญ่เกินไปหรือไม่
-                    potential_text = " ".join(current_chunk_texts + [text_content])
-                    if len(potential_text) > MAX_CHUNK_LENGTH:
-                        # ถ้า chunk จะใหญ่เกินไป ให้บันทึก chunk ปัจจุบันก่อน แล้วเริ่ม chunk ใหม่
-                        if current_chunk_texts:
-                            merged_text = " ".join(current_chunk_texts)
-                            merged_text_chunks.append({
-                                'text': merged_text,
-                                'y_pos': current_chunk_y_pos,
-                                'bbox': current_chunk_bbox
-                            })
-                        # เริ่ม chunk ใหม่ด้วย text ปัจจุบัน
-                        current_chunk_texts = [text_content]
-                        current_chunk_y_pos = y_pos
-                        current_chunk_bbox = bbox
-                    else:
-                        # ถ้า chunk ยังไม่ใหญ่เกินไป ให้รวม text นี้เข้าไป
-                        current_chunk_texts.append(text_content)
-                        if current_chunk_bbox is None:
-                            current_chunk_bbox = bbox
-                        current_chunk_y_pos = y_pos  # อัพเดท y_pos เป็นของ block ล่าสุด
-                else:
-                    # ถ้า y_pos ต่างกันมาก แสดงว่าเป็นย่อหน้าใหม่ - สร้าง chunk ใหม่
-                    if current_chunk_texts:
-                        merged_text = " ".join(current_chunk_texts)
-                        merged_text_chunks.append({
-                            'text': merged_text,
-                            'y_pos': current_chunk_y_pos,
-                            'bbox': current_chunk_bbox
-                        })
-                    # เริ่ม chunk ใหม่
-                    current_chunk_texts = [text_content]
-                    current_chunk_y_pos = y_pos
-                    current_chunk_bbox = bbox
-            
-            # เพิ่ม chunk สุดท้าย
-            if current_chunk_texts:
-                merged_text = " ".join(current_chunk_texts)
-                merged_text_chunks.append({
-                    'text': merged_text,
-                    'y_pos': current_chunk_y_pos,
-                    'bbox': current_chunk_bbox
-                })
-            
-            # 🆕 ถ้ายังมี chunks ที่สั้นมาก (< 100 ตัวอักษร) ให้รวมกับ chunks ที่อยู่ใกล้กัน
-            # รอบที่ 2: รวม chunks ที่สั้นมากกับ chunks ที่อยู่ใกล้กัน
-            final_merged_chunks = []
-            for i, chunk in enumerate(merged_text_chunks):
-                chunk_text = chunk['text']
-                chunk_length = len(chunk_text) if chunk_text else 0
-                chunk_y_pos = chunk['y_pos']
-                
-                # ถ้า chunk สั้นมาก (< 100 ตัวอักษร) และมี chunk ถัดไป ให้รวมกัน
-                if chunk_length < 100 and i < len(merged_text_chunks) - 1:
-                    next_chunk = merged_text_chunks[i + 1]
-                    next_y_pos = next_chunk['y_pos']
-                    next_text = next_chunk['text']
-                    next_length = len(next_text) if next_text else 0
-                    # ถ้า y_pos ใกล้กัน (ภายใน 100 pixels) ให้รวมกัน
-                    if abs(next_y_pos - chunk_y_pos) <= 100:
-                        # 🆕 ตรวจสอบว่าถ้ารวมแล้ว chunk จะใหญ่เกินไปหรือไม่
-                        combined_text = chunk_text + " " + next_text
-                        if len(combined_text) <= MAX_CHUNK_LENGTH:
-                            # รวมกับ chunk ถัดไป
-                            final_merged_chunks.append({
-                                'text': combined_text,
-                                'y_pos': chunk_y_pos,
-                                'bbox': chunk.get('bbox')
-                            })
-                            # ข้าม chunk ถัดไป (เพราะรวมแล้ว)
-                            merged_text_chunks[i + 1] = None  # mark as merged
-                        else:
-                            # ถ้า chunk จะใหญ่เกินไป ให้เก็บ chunk ปัจจุบันไว้
-                            final_merged_chunks.append(chunk)
-                    else:
-                        final_merged_chunks.append(chunk)
-                else:
-                    # ถ้า chunk นี้ถูก mark เป็น None (ถูกรวมไปแล้ว) ให้ข้าม
-                    if chunk is not None:
-                        final_merged_chunks.append(chunk)
-            
-            # กรอง None ออก
-            final_merged_chunks = [c for c in final_merged_chunks if c is not None]
+            # ไม่เกิน 2000 ตัวอักษรต่อ chunk (ดู merge_text_elements)
+            final_merged_chunks = merge_text_elements(text_elements)
             
             # แทนที่ text elements เดิมด้วย merged chunks
             # ลบ text elements เดิมออกจาก elements list
@@ -782,31 +1402,71 @@ def process_single_page(page_num, pymupdf_page, pdfplumber_pdf, doc_id_counter):
                 })
             
             # เรียงลำดับใหม่หลังจาก merge
-            elements.sort(key=lambda x: x['y_pos'])
+            elements.sort(key=itemgetter('y_pos'))
             print(f"🔄 รวม text blocks เป็น {len(final_merged_chunks)} chunks (จาก {len(text_elements)} blocks เดิม)")
             
-            # 🆕 ตรวจสอบและแสดงสถิติของ chunks
-            chunk_lengths = [len(chunk['text']) for chunk in final_merged_chunks if chunk.get('text')]
-            if chunk_lengths:
-                avg_length = sum(chunk_lengths) / len(chunk_lengths)
-                max_length = max(chunk_lengths)
-                min_length = min(chunk_lengths)
-                chunks_over_limit = sum(1 for length in chunk_lengths if length > MAX_CHUNK_LENGTH)
+            # 🆕 ตรวจสอบและแสดงสถิติของ chunks (เฉพาะ PIPELINE_VERBOSE คำนวณในรอบเดียว)
+            if PIPELINE_VERBOSE:
+                non_empty = total_length = chunks_over_limit = 0
+                min_length = max_length = None
+                for chunk in final_merged_chunks:
+                    length = len(chunk['text'])
+                    if not length:
+                        continue
+                    non_empty += 1
+                    total_length += length
+                    if min_length is None or length < min_length:
+                        min_length = length
+                    if max_length is None or length > max_length:
+                        max_length = length
+                    if length > TEXT_MERGE_MAX_LENGTH:
+                        chunks_over_limit += 1
                 
-                print(f"   📊 สถิติ chunks:")
-                print(f"      - จำนวน chunks: {len(final_merged_chunks)}")
-                print(f"      - ขนาดเฉลี่ย: {avg_length:.0f} ตัวอักษร")
-                print(f"      - ขนาดสูงสุด: {max_length} ตัวอักษร")
-                print(f"      - ขนาดต่ำสุด: {min_length} ตัวอักษร")
-                if chunks_over_limit > 0:
-                    print(f"      ⚠️ พบ {chunks_over_limit} chunks ที่ใหญ่เกิน {MAX_CHUNK_LENGTH} ตัวอักษร")
-                else:
-                    print(f"      ✅ ทุก chunks มีขนาดไม่เกิน {MAX_CHUNK_LENGTH} ตัวอักษร")
-            
-            for i, chunk in enumerate(final_merged_chunks[:5], 1):  # แสดง 5 อันดับแรก
-                chunk_length = len(chunk.get('text', ''))
-                size_indicator = " ⚠️ ใหญ่เกินไป" if chunk_length > MAX_CHUNK_LENGTH else ""
-                print(f"   📝 Merged chunk {i}: {chunk_length} ตัวอักษร{size_indicator}")
+                if max_length is not None:
+                    print(f"   📊 สถิติ chunks:")
+                    print(f"      - จำนวน chunks: {len(final_merged_chunks)}")
+                    print(f"      - ขนาดเฉลี่ย: {total_length / non_empty:.0f} ตัวอักษร")
+                    print(f"      - ขนาดสูงสุด: {max_length} ตัวอักษร")
+                    print(f"      - ขนาดต่ำสุด: {min_length} ตัวอักษร")
+                    if chunks_over_limit > 0:
+                        print(f"      ⚠️ พบ {chunks_over_limit} chunks ที่ใหญ่เกิน {TEXT_MERGE_MAX_LENGTH} ตัวอักษร")
+                    else:
+                        print(f"      ✅ ทุก chunks มีขนาดไม่เกิน {TEXT_MERGE_MAX_LENGTH} ตัวอักษร")
+                
+                for i, chunk in enumerate(final_merged_chunks[:5], 1):  # แสดง 5 อันดับแรก
+                    chunk_length = len(chunk['text'])
+                    size_indicator = " ⚠️ ใหญ่เกินไป" if chunk_length > TEXT_MERGE_MAX_LENGTH else ""
+                    print(f"   📝 Merged chunk {i}: {chunk_length} ตัวอักษร{size_indicator}")
+        
+        # === STEP 2.6: OCR รูปทั้งหน้าพร้อมกัน (Typhoon ส่ง request พร้อมกัน, EasyOCR ทำเป็น batch) ===
+        extract_image = pymupdf_page.parent.extract_image  # ใช้ซ้ำทุกรูปในหน้า
+        ocr_jobs = []  # (element_index, image_bytes, width, height) ของรูปที่ผ่านเกณฑ์ขนาด
+        for element_index, element in enumerate(elements):
+            if element['type'] != 'image':
+                continue
+            data = element['data']
+            width, height = data['width'], data['height']
+            if width * height > 1500000 or width < 50 or height < 50:
+                continue
+            try:
+                ocr_jobs.append((element_index, extract_image(data['xref'])["image"], width, height))
+            except Exception as e:
+                print(f"   ❗ Error extracting image {data['image_index'] + 1}: {e}")
+        
+        # element_index -> (image_bytes, original_text, improved_text)
+        # ถ้า OCR ทั้ง batch ล้มเหลว STEP 3 จะทำ OCR รูปนั้นทีละรูปแทน
+        ocr_results = {}
+        if ocr_jobs:
+            print(f"   🔍 กำลังทำ OCR {len(ocr_jobs)} รูป...")
+            try:
+                batch_results = perform_ocr_on_images_batched(
+                    [(image_bytes, width, height) for _, image_bytes, width, height in ocr_jobs]
+                )
+                for (element_index, image_bytes, _, _), (original_text, improved_text) in zip(ocr_jobs, batch_results):
+                    ocr_results[element_index] = (image_bytes, original_text, improved_text)
+            except Exception as e:
+                print(f"   ⚠️ OCR แบบ batch ล้มเหลว ({e}) จะทำทีละรูปแทน")
+            del ocr_jobs
         
         # === STEP 3: ประมวลผลตามลำดับที่เรียงแล้ว (เจออะไรก่อนทำอันนั้นก่อน) ===
         text_chunk_counter = 0
@@ -844,29 +1504,31 @@ def process_single_page(page_num, pymupdf_page, pdfplumber_pdf, doc_id_counter):
                 
                 try:
                     print(f"   🖼️ กำลังประมวลผลรูปภาพ {img_index + 1}...")
-                    base_image = pymupdf_page.parent.extract_image(xref)
-                    image_bytes = base_image["image"]
                     
-                    # ตรวจสอบขนาดรูปภาพ
-                    image = Image.open(io.BytesIO(image_bytes))
-                    width, height = image.size
+                    # ตรวจสอบขนาดรูปภาพ (ได้จาก get_images ตอนเก็บตำแหน่ง ไม่ต้อง extract หรือเปิดรูปด้วย PIL)
+                    width, height = data['width'], data['height']
                     print(f"   📏 ขนาดรูปภาพ: {width}x{height} pixels")
                     
                     # ข้ามรูปที่ใหญ่เกินไป
                     if width * height > 1500000:
                         print(f"   ⚠️ ข้ามรูปใหญ่ ({width}x{height}, {width*height:,} pixels > 1,500,000)")
-                        del image, image_bytes
                         continue
                     
                     # ข้ามรูปที่เล็กเกินไป
                     if width < 50 or height < 50:
                         print(f"   ⚠️ ข้ามรูปเล็ก ({width}x{height} < 50x50)")
-                        del image, image_bytes
                         continue
                     
-                    # OCR (ใช้ Typhoon OCR) และปรับปรุงข้อความด้วย PyThaiNLP
-                    print(f"   🔍 กำลังทำ OCR...")
-                    original_text, improved_text = perform_ocr_on_image_bytes(image_bytes)
+                    if element_index in ocr_results:
+                        # OCR ไปแล้วใน STEP 2.6
+                        image_bytes, original_text, improved_text = ocr_results.pop(element_index)
+                    else:
+                        # extract bytes เฉพาะรูปที่ผ่านเกณฑ์ขนาด
+                        image_bytes = extract_image(xref)["image"]
+                        
+                        # OCR (ใช้ Typhoon OCR) และปรับปรุงข้อความด้วย PyThaiNLP
+                        print(f"   🔍 กำลังทำ OCR...")
+                        original_text, improved_text = perform_ocr_on_image_bytes(image_bytes)
                     
                     if improved_text.strip():
                         page_results['has_content'] = True
@@ -882,7 +1544,7 @@ def process_single_page(page_num, pymupdf_page, pdfplumber_pdf, doc_id_counter):
                             "image_index": img_index + 1,
                             "original_text": original_text,
                             "improved_text": improved_text,
-                            "image_base64": base64.b64encode(image_bytes).decode("utf-8"),
+                            "image_bytes": image_bytes,  # bytes ดิบ ย้ายไป GridFS ตอนบันทึก
                             "doc_id": f"doc_{doc_id_counter}_{page_num + 1}_img_{img_index + 1}",
                             "bbox": convert_bbox_to_mongodb_format(data['bbox'])
                         }
@@ -892,7 +1554,7 @@ def process_single_page(page_num, pymupdf_page, pdfplumber_pdf, doc_id_counter):
                         print(f"   ⚠️ ไม่พบข้อความในรูปภาพ {img_index + 1} (OCR ไม่เจอข้อความ) - ข้าม")
                     
                     # ล้าง memory
-                    del image, image_bytes
+                    del image_bytes
                     
                 except Exception as e:
                     print(f"   ❗ Error processing image {img_index + 1}: {e}")
@@ -942,117 +1604,163 @@ def process_single_page(page_num, pymupdf_page, pdfplumber_pdf, doc_id_counter):
         traceback.print_exc()
         return page_results
 
-# ✅ ฟังก์ชันช่วยบันทึกข้อมูลทีละหน้า
-def store_page_results_to_mongodb(page_results, client, is_first_page=False):
+# ✅ ฟังก์ชันสำหรับ worker process: extract หน้าเดียวจาก path
+def _extract_page(path, page_num):
     """
-    บันทึกผลลัพธ์จากหนึ่งหน้าลง MongoDB ทันที
-    🆕 เพิ่มการสร้าง embeddings ก่อนบันทึก
+    Extract หน้าเดียวใน worker process (เปิดไฟล์ PDF ใน process ตัวเอง เพราะ handle ของ PyMuPDF แชร์ข้าม process ไม่ได้)
+    ไฟล์ที่เปิดแล้วเก็บไว้ใช้ซ้ำกับหน้าถัดไปใน worker เดียวกัน
+    
+    Args:
+        path: path ของไฟล์ PDF
+        page_num: หมายเลขหน้า (0-based)
+        
+    Returns:
+        dict: ผลลัพธ์จาก process_single_page
+    """
+    if getattr(_extract_page, 'path', None) != path:
+        _extract_page.pymupdf_doc = fitz.open(path)
+        _extract_page.pdfplumber_pdf = pdfplumber.open(path)
+        _extract_page.path = path
+    
+    return process_single_page(
+        page_num=page_num,
+        pymupdf_page=_extract_page.pymupdf_doc[page_num],
+        pdfplumber_pdf=_extract_page.pdfplumber_pdf,
+        doc_id_counter=1
+    )
+
+# ✅ ฟังก์ชันล้างข้อมูลเก่าก่อนเริ่ม pipeline
+def reset_original_collections(client):
+    """
+    ลบ collections ของ chunks และไฟล์รูปใน GridFS ทั้งหมดด้วย drop (ไม่ลบทีละเอกสาร)
+    แล้วสร้าง index ใหม่ รวมถึง index ของ embedding cache (cache ไม่ถูกลบ)
+    เรียกครั้งเดียวก่อนบันทึกหน้าแรก
+    """
+    db_original = client[ORIGINAL_DB_NAME]
+    get_embed_cache_collection(client)
+    
+    print("🗑️ ลบข้อมูลเก่าใน MongoDB...")
+    for collection_name in (ORIGINAL_TEXT_COLLECTION, ORIGINAL_IMAGE_COLLECTION, ORIGINAL_TABLE_COLLECTION):
+        col = db_original[collection_name]
+        col.drop()
+        ensure_chunk_indexes(col)
+    get_image_bucket(db_original, drop=True)
+    print("✅ ลบข้อมูลเก่าเสร็จสิ้น")
+
+# ✅ ฟังก์ชันเตรียมผลลัพธ์หนึ่งหน้าก่อนบันทึก (ลบข้อมูลเก่า + สร้าง embeddings)
+def prepare_page_results(page_results, client, is_first_page=False):
+    """
+    เตรียมผลลัพธ์จากหนึ่งหน้าก่อนบันทึก: หน้าแรกจะลบข้อมูลเก่าและสร้าง index ใหม่
+    แล้วเพิ่ม created_at และ embeddings ให้ทุก chunk (แก้ chunk ใน page_results โดยตรง)
     
     Args:
         page_results: ผลลัพธ์จาก process_single_page()
         client: MongoDB client (เปิดไว้แล้ว)
-        is_first_page: เป็นหน้าแรกหรือไม่ (ถ้าใช่จะลบข้อมูลเก่าก่อน)
+        is_first_page: เป็นหน้าแรกหรือไม่ (ถ้าใช่จะลบข้อมูลเก่าก่อนด้วย reset_original_collections)
+        
+    Returns:
+        bool: สำเร็จหรือไม่
     """
     try:
-        # เตรียม database และ collections
-        db_original = client[ORIGINAL_DB_NAME]
-        
-        orig_text_col = db_original[ORIGINAL_TEXT_COLLECTION]
-        orig_image_col = db_original[ORIGINAL_IMAGE_COLLECTION]
-        orig_table_col = db_original[ORIGINAL_TABLE_COLLECTION]
-        
-        # ลบข้อมูลเก่าครั้งเดียวตอนหน้าแรก
+        # ลบข้อมูลเก่าครั้งเดียวตอนหน้าแรก (main() เรียก reset_original_collections เองก่อน loop)
         if is_first_page:
-            print("🗑️ ลบข้อมูลเก่าใน MongoDB...")
-            orig_text_col.delete_many({})
-            orig_image_col.delete_many({})
-            orig_table_col.delete_many({})
-            print("✅ ลบข้อมูลเก่าเสร็จสิ้น")
+            reset_original_collections(client)
+        embed_cache = client[ORIGINAL_DB_NAME][EMBED_CACHE_COLLECTION]
         
-        # เพิ่ม created_at และ embeddings ให้ทุก chunk
+        # เพิ่ม created_at และ embeddings ให้ทุก chunk (encode ทุกประเภทของหน้านี้ใน batch เดียว)
         now = datetime.now()
+        all_chunks = page_results['text_chunks'] + page_results['image_chunks'] + page_results['table_chunks']
+        if all_chunks:
+            print(f"   🔄 กำลังสร้าง embeddings สำหรับ {len(all_chunks)} chunks...")
+            for chunk in all_chunks:
+                chunk['created_at'] = now
+            attach_embeddings(all_chunks, cache_collection=embed_cache)
+        
+        return True
+        
+    except Exception as e:
+        print(f"❗ Error preparing page results for MongoDB: {e}")
+        import traceback
+        traceback.print_exc()
+        return False
+
+# ✅ ฟังก์ชันบันทึกผลลัพธ์หนึ่งหน้าที่เตรียมแล้วลง MongoDB
+def insert_page_results(page_results, client):
+    """
+    บันทึก chunks ของหนึ่งหน้า (ผ่าน prepare_page_results แล้ว) ลง MongoDB
+    ไม่ใช้ model จึงรันใน writer thread ระหว่างที่หน้าถัดไปกำลังสร้าง embeddings ได้
+    
+    Args:
+        page_results: ผลลัพธ์จาก process_single_page() ที่ผ่าน prepare_page_results แล้ว
+        client: MongoDB client (เปิดไว้แล้ว)
+        
+    Returns:
+        tuple: (สำเร็จหรือไม่, dict จำนวน chunks ที่ insert ได้จริงแยกตามชนิด)
+               ถ้าล้มเหลวกลางทาง dict ยังนับชนิดที่ insert ไปแล้ว
+    """
+    inserted = {'text_chunks': 0, 'image_chunks': 0, 'table_chunks': 0}
+    try:
+        db_original = client[ORIGINAL_DB_NAME]
         
         # บันทึก Original Data - Text Chunks
         if page_results['text_chunks']:
-            print(f"   🔄 กำลังสร้าง embeddings สำหรับ {len(page_results['text_chunks'])} text chunks...")
-            for chunk in page_results['text_chunks']:
-                chunk['created_at'] = now
-                # 🆕 สร้าง embedding จาก text
-                text_content = chunk.get('text', '')
-                if text_content:
-                    embedding = create_text_embedding(text_content)
-                    if embedding:
-                        chunk['embeddings'] = embedding
-                    else:
-                        print(f"   ⚠️ ไม่สามารถสร้าง embedding สำหรับ text chunk {chunk.get('chunk_id', 'unknown')} ได้")
-            orig_text_col.insert_many(page_results['text_chunks'])
-            print(f"   ✅ บันทึก {len(page_results['text_chunks'])} text chunks (พร้อม embeddings)")
+            inserted['text_chunks'] = insert_chunks(db_original[ORIGINAL_TEXT_COLLECTION], page_results['text_chunks'])
+            print(f"   ✅ บันทึก {inserted['text_chunks']} text chunks (พร้อม embeddings)")
         
-        # บันทึก Original Data - Image Chunks
+        # บันทึก Original Data - Image Chunks (ไฟล์รูปไปอยู่ใน GridFS เอกสารเก็บแค่ image_id)
         if page_results['image_chunks']:
-            print(f"   🔄 กำลังสร้าง embeddings สำหรับ {len(page_results['image_chunks'])} image chunks...")
-            for chunk in page_results['image_chunks']:
-                chunk['created_at'] = now
-                # 🆕 สร้าง embedding จาก text (ข้อความที่ได้จาก OCR)
-                text_content = chunk.get('text', '')
-                if text_content:
-                    embedding = create_text_embedding(text_content)
-                    if embedding:
-                        chunk['embeddings'] = embedding
-                    else:
-                        print(f"   ⚠️ ไม่สามารถสร้าง embedding สำหรับ image chunk {chunk.get('chunk_id', 'unknown')} ได้")
-            orig_image_col.insert_many(page_results['image_chunks'])
-            print(f"   ✅ บันทึก {len(page_results['image_chunks'])} image chunks (พร้อม embeddings)")
+            store_chunk_images(page_results['image_chunks'], get_image_bucket(db_original))
+            inserted['image_chunks'] = insert_chunks(db_original[ORIGINAL_IMAGE_COLLECTION], page_results['image_chunks'])
+            print(f"   ✅ บันทึก {inserted['image_chunks']} image chunks (พร้อม embeddings)")
         
         # บันทึก Original Data - Table Chunks
         if page_results['table_chunks']:
-            print(f"   🔄 กำลังสร้าง embeddings สำหรับ {len(page_results['table_chunks'])} table chunks...")
-            for chunk in page_results['table_chunks']:
-                chunk['created_at'] = now
-                # 🆕 สร้าง embedding จาก text
-                text_content = chunk.get('text', '')
-                if text_content:
-                    embedding = create_text_embedding(text_content)
-                    if embedding:
-                        chunk['embeddings'] = embedding
-                    else:
-                        print(f"   ⚠️ ไม่สามารถสร้าง embedding สำหรับ table chunk {chunk.get('chunk_id', 'unknown')} ได้")
-            orig_table_col.insert_many(page_results['table_chunks'])
-            print(f"   ✅ บันทึก {len(page_results['table_chunks'])} table chunks (พร้อม embeddings)")
+            inserted['table_chunks'] = insert_chunks(db_original[ORIGINAL_TABLE_COLLECTION], page_results['table_chunks'])
+            print(f"   ✅ บันทึก {inserted['table_chunks']} table chunks (พร้อม embeddings)")
         
-        return True
+        return True, inserted
         
     except Exception as e:
         print(f"❗ Error storing page results to MongoDB: {e}")
         import traceback
         traceback.print_exc()
-        return False
+        return False, inserted
+
+# ✅ ฟังก์ชันช่วยบันทึกข้อมูลทีละหน้า
+def store_page_results_to_mongodb(page_results, client, is_first_page=False):
+    """
+    บันทึกผลลัพธ์จากหนึ่งหน้าลง MongoDB ทันที
+    🆕 เพิ่มการสร้าง embeddings ก่อนบันทึก
+    
+    Args:
+        page_results: ผลลัพธ์จาก process_single_page()
+        client: MongoDB client (เปิดไว้แล้ว)
+        is_first_page: เป็นหน้าแรกหรือไม่ (ถ้าใช่จะลบข้อมูลเก่าก่อน)
+    """
+    return (prepare_page_results(page_results, client, is_first_page=is_first_page)
+            and insert_page_results(page_results, client)[0])
 
 # ✅ ฟังก์ชันหลัก (ประมวลผลหนึ่งหน้า → บันทึก → loop ต่อ)
 def main():
     print("🚀 เริ่ม Pipeline: Extract → OCR + PyThaiNLP → Store")
-    print("📄 ประมวลผลหนึ่งหน้า → บันทึก MongoDB → loop ต่อ")
+    print("📄 ประมวลผลทีละหน้า → บันทึก MongoDB เป็น batch → loop ต่อ")
     print()
     
     client = None
-    pymupdf_doc = None
-    pdfplumber_pdf = None
     
     try:
         # === INITIALIZATION ===
         print("=== INITIALIZATION ===")
-        check_memory()
+        check_memory(force=True)
         
-        # เปิดไฟล์ PDF ทั้ง PyMuPDF และ pdfplumber
-        pymupdf_doc = fitz.open(PDF_PATH)
-        pdfplumber_pdf = pdfplumber.open(PDF_PATH)
-        
-        total_pages = len(pymupdf_doc)
+        # นับจำนวนหน้า (worker แต่ละตัวเปิดไฟล์ PDF เอง)
+        with fitz.open(PDF_PATH) as pymupdf_doc:
+            total_pages = len(pymupdf_doc)
         print(f"📚 จำนวนหน้าทั้งหมด: {total_pages} หน้า")
         
         # เปิด MongoDB connection ครั้งเดียว (ใช้ตลอดทั้ง pipeline)
         print(f"🔗 กำลังเชื่อมต่อ MongoDB Atlas...")
-        client = MongoClient(MONGO_URL, serverSelectionTimeoutMS=5000)
+        client = MongoClient(MONGO_URL, serverSelectionTimeoutMS=5000, compressors=MONGO_COMPRESSORS)
         client.admin.command('ping')
         print(f"✅ เชื่อมต่อ MongoDB Atlas สำเร็จ")
         
@@ -1061,54 +1769,117 @@ def main():
         total_image_chunks = 0
         total_table_chunks = 0
         
-        doc_id_counter = 1  # สำหรับสร้าง doc_id
-        
-        # === LOOP: More Pages (ประมวลผลและบันทึกทีละหน้า) ===
+        # === LOOP: More Pages (extract หลายหน้าพร้อมกันใน process pool แล้วบันทึกตามลำดับหน้า) ===
         print("\n=== STEP 1: PAGE-BY-PAGE PROCESSING & STORING ===")
-        for page_num in range(total_pages):
-            print(f"\n{'='*60}")
-            print(f"📄 กำลังประมวลผลหน้า {page_num + 1}/{total_pages}")
-            print(f"{'='*60}")
-            
-            # ประมวลผลหน้าเดียว (Extract)
-            page_results = process_single_page(
-                page_num=page_num,
-                pymupdf_page=pymupdf_doc[page_num],
-                pdfplumber_pdf=pdfplumber_pdf,
-                doc_id_counter=doc_id_counter
-            )
-            
-            # บันทึกลง MongoDB ทันที (หน้าแรกจะลบข้อมูลเก่าก่อน)
-            is_first_page = (page_num == 0)
-            print(f"\n💾 บันทึกผลลัพธ์จากหน้า {page_num + 1} ลง MongoDB...")
+        print(f"⚙️ ใช้ {PDF_WORKERS} process สำหรับ extract")
+        # semaphore เดียวใช้ร่วมกันทุก process: request ของ Typhoon OCR พร้อมกันไม่เกิน TYPHOON_OCR_WORKERS ทั้ง pipeline
+        executor = ProcessPoolExecutor(
+            max_workers=PDF_WORKERS,
+            initializer=_init_ocr_worker,
+            initargs=(multiprocessing.Semaphore(TYPHOON_OCR_WORKERS),)
+        )
+        # writer thread: insert หน้าก่อนหน้าลง MongoDB ระหว่างที่หน้าปัจจุบันกำลังสร้าง embeddings
+        writer = ThreadPoolExecutor(max_workers=1)
+        pending_insert = None  # (ช่วงหน้า, future) ของ batch ที่กำลัง insert อยู่
+        # หน้าที่เตรียมแล้วแต่ยังไม่ได้ insert (รวมกันเป็น batch เดียวเมื่อครบ INSERT_FLUSH_CHUNKS)
+        buffered_pages = []
+        buffered_results = {'text_chunks': [], 'image_chunks': [], 'table_chunks': []}
+        
+        def finish_pending_insert():
+            """รอ insert ของ batch ก่อนหน้าให้เสร็จแล้วนับจำนวน chunks ที่ insert ได้จริง"""
+            nonlocal pending_insert, total_text_chunks, total_image_chunks, total_table_chunks
+            if pending_insert is None:
+                return
+            page_label, future = pending_insert
+            pending_insert = None
+            success, inserted = future.result()
             
-            success = store_page_results_to_mongodb(page_results, client, is_first_page=is_first_page)
+            # นับจำนวน chunks (นับเฉพาะที่ insert สำเร็จ แม้ batch จะล้มเหลวกลางทาง)
+            total_text_chunks += inserted['text_chunks']
+            total_image_chunks += inserted['image_chunks']
+            total_table_chunks += inserted['table_chunks']
             
             if success:
-                # นับจำนวน chunks
-                total_text_chunks += len(page_results['text_chunks'])
-                total_image_chunks += len(page_results['image_chunks'])
-                total_table_chunks += len(page_results['table_chunks'])
-                
-                print(f"✅ บันทึกหน้า {page_num + 1} เสร็จสิ้น")
+                print(f"✅ บันทึกหน้า {page_label} เสร็จสิ้น")
             else:
-                print(f"⚠️ มีปัญหาในการบันทึกหน้า {page_num + 1} แต่จะดำเนินการต่อ...")
-            
-            # ตรวจสอบ memory ทุก 5 หน้า
-            if (page_num + 1) % 5 == 0:
-                check_memory()
-            
-            # ตรวจสอบว่ามีหน้าอื่นอีกไหม (More Pages Decision)
-            if page_num < total_pages - 1:
-                print(f"➡️ มีหน้าอื่นอีก {total_pages - page_num - 1} หน้า")
+                print(f"⚠️ มีปัญหาในการบันทึกหน้า {page_label} แต่จะดำเนินการต่อ...")
+        
+        def flush_buffered_pages(force=False):
+            """ส่ง chunks ที่สะสมไว้ให้ writer insert เมื่อครบ INSERT_FLUSH_CHUNKS (force=True ส่งทันที)"""
+            nonlocal pending_insert, buffered_pages, buffered_results
+            buffered_chunks = sum(len(chunks) for chunks in buffered_results.values())
+            if not buffered_pages or (not force and buffered_chunks < INSERT_FLUSH_CHUNKS):
+                return
+            if buffered_pages[0] == buffered_pages[-1]:
+                page_label = f"{buffered_pages[0] + 1}"
             else:
-                print(f"✅ ประมวลผลและบันทึกครบทุกหน้าแล้ว ({total_pages} หน้า)")
+                page_label = f"{buffered_pages[0] + 1}-{buffered_pages[-1] + 1}"
+            
+            # insert ทีละ batch ตามลำดับ: รอ batch ก่อนหน้าเสร็จก่อนส่ง batch นี้
+            finish_pending_insert()
+            pending_insert = (page_label, writer.submit(insert_page_results, buffered_results, client))
+            buffered_pages = []
+            buffered_results = {'text_chunks': [], 'image_chunks': [], 'table_chunks': []}
         
-        # ปิดไฟล์ PDF
-        pymupdf_doc.close()
-        pdfplumber_pdf.close()
-        pymupdf_doc = None
-        pdfplumber_pdf = None
+        try:
+            # executor.map คืนผลลัพธ์ตามลำดับหน้าเสมอ
+            page_results_iter = executor.map(_extract_page, repeat(PDF_PATH), range(total_pages), chunksize=4)
+            
+            # ล้างข้อมูลเก่าครั้งเดียวก่อนบันทึก (ทำระหว่างที่ worker เริ่ม extract หน้าแรกๆ ไปแล้ว)
+            reset_original_collections(client)
+            
+            for page_num, page_results in enumerate(page_results_iter):
+                # แสดงความคืบหน้าทุก PROGRESS_EVERY_PAGES หน้า (ทุกหน้าถ้า PIPELINE_VERBOSE)
+                show_progress = (PIPELINE_VERBOSE or page_num % PROGRESS_EVERY_PAGES == 0
+                                 or page_num == total_pages - 1)
+                if show_progress:
+                    print(f"\n{'='*60}")
+                    print(f"📄 ได้ผลลัพธ์หน้า {page_num + 1}/{total_pages}")
+                    print(f"{'='*60}")
+                
+                # บันทึกลง MongoDB (ข้อมูลเก่าถูกลบไปแล้วก่อนเริ่ม loop)
+                if PIPELINE_VERBOSE:
+                    print(f"\n💾 บันทึกผลลัพธ์จากหน้า {page_num + 1} ลง MongoDB...")
+                
+                # สร้าง embeddings ใน thread หลัก (ระหว่างนี้ writer ยัง insert batch ก่อนหน้าอยู่)
+                prepared = prepare_page_results(page_results, client)
+                
+                # สะสมไว้ก่อน แล้ว insert หลายหน้าพร้อมกันเมื่อครบ INSERT_FLUSH_CHUNKS
+                if prepared:
+                    buffered_pages.append(page_num)
+                    for key, chunks in buffered_results.items():
+                        chunks.extend(page_results[key])
+                    flush_buffered_pages()
+                else:
+                    print(f"⚠️ มีปัญหาในการบันทึกหน้า {page_num + 1} แต่จะดำเนินการต่อ...")
+                
+                # ตรวจสอบ memory ทุก 5 หน้า
+                if (page_num + 1) % 5 == 0:
+                    check_memory()
+                
+                # ตรวจสอบว่ามีหน้าอื่นอีกไหม (More Pages Decision)
+                if page_num < total_pages - 1:
+                    if show_progress:
+                        print(f"➡️ มีหน้าอื่นอีก {total_pages - page_num - 1} หน้า")
+                else:
+                    print(f"✅ ประมวลผลและบันทึกครบทุกหน้าแล้ว ({total_pages} หน้า)")
+            
+            # insert chunks ที่เหลือ
+            flush_buffered_pages(force=True)
+            finish_pending_insert()
+        except BaseException:
+            # ถ้าหยุดกลางทาง ให้ insert หน้าที่เตรียมเสร็จแล้วแต่ยังค้างอยู่ใน buffer ด้วย
+            # error ระหว่างนี้แค่แจ้งเตือน ไม่ให้บัง error แรกที่ทำให้หยุด
+            executor.shutdown(wait=True, cancel_futures=True)
+            try:
+                flush_buffered_pages(force=True)
+                finish_pending_insert()
+            except Exception as flush_error:
+                print(f"❗ Error inserting remaining chunks: {flush_error}")
+            raise
+        finally:
+            executor.shutdown(wait=True, cancel_futures=True)
+            writer.shutdown(wait=True)
         
         # === สรุปผลการประมวลผล ===
         print("\n" + "="*60)
@@ -1129,16 +1900,16 @@ def main():
         traceback.print_exc()
         print("🔄 Running garbage collection...")
         gc.collect()
-        check_memory()
+        check_memory(force=True)
         
         # แสดงข้อมูลที่บันทึกไปแล้ว (ถ้ามี)
         if client:
             try:
                 db_original = client[ORIGINAL_DB_NAME]
                 
-                orig_text_count = db_original[ORIGINAL_TEXT_COLLECTION].count_documents({})
-                orig_image_count = db_original[ORIGINAL_IMAGE_COLLECTION].count_documents({})
-                orig_table_count = db_original[ORIGINAL_TABLE_COLLECTION].count_documents({})
+                orig_text_count = db_original[ORIGINAL_TEXT_COLLECTION].estimated_document_count()
+                orig_image_count = db_original[ORIGINAL_IMAGE_COLLECTION].estimated_document_count()
+                orig_table_count = db_original[ORIGINAL_TABLE_COLLECTION].estimated_document_count()
                 
                 print(f"\n⚠️ ข้อมูลที่บันทึกไปแล้ว:")
                 print(f"   - Original text chunks: {orig_text_count}")
@@ -1155,18 +1926,6 @@ def main():
                 print("🔌 ปิด MongoDB connection")
             except:
                 pass
-        
-        # ปิดไฟล์ PDF (ถ้ายังไม่ได้ปิด)
-        if pymupdf_doc:
-            try:
-                pymupdf_doc.close()
-            except:
-                pass
-        if pdfplumber_pdf:
-            try:
-                pdfplumber_pdf.close()
-            except:
-                pass
 
 if __name__ == "__main__":
     main()
@@ -1,12 +1,15 @@
 import os
 import re
 import logging
+import functools
 from datetime import datetime, timedelta, time as dt_time
 from typing import Tuple
+import numpy as np
 from pymongo import MongoClient
+from bson.binary import Binary
 from sklearn.metrics.pairwise import cosine_similarity
-from sentence_transformers import SentenceTransformer
 from dotenv import load_dotenv
+from .multimodel_rag import get_embedding_model
 from .birth_date_parser import generate_astrology_reading, generate_detailed_astrology_reading, extract_birth_info_from_message
 
 # แก้ไขปัญหา MPS device - ใช้ CPU แทน
@@ -53,26 +56,32 @@ ASTRO_SYSTEM_ENTITIES = {
 
 NOISE_KEYWORDS = ["pottery", "ceramic", "clay", "vessel", "sherd", "kiln", "excavation"]  # คำที่มักเจอในเอกสารขยะ
 
+ZODIAC_ENTITY_KEYS = frozenset(["aries", "taurus", "gemini", "cancer", "leo", "virgo", "libra", "scorpio", "sagittarius", "capricorn", "aquarius", "pisces"])
+
+def compile_keyword_pattern(keywords) -> re.Pattern:
+    """
+    รวม keywords เป็น regex เดียว (เดินผ่านข้อความรอบเดียวแทนการใช้ `in` ทีละคำ)
+    ใช้ lookahead จึงเจอทุกตำแหน่งแม้ keyword ซ้อนกัน (เช่น "node" ใน "south node")
+    """
+    alternation = '|'.join(re.escape(kw) for kw in sorted(set(keywords), key=len, reverse=True))
+    return re.compile(f'(?=({alternation}))')
+
+_ASTRO_KEYWORD_TO_ENTITY = {kw: key for key, keywords in ASTRO_SYSTEM_ENTITIES.items() for kw in keywords}
+_ASTRO_ENTITY_RE = compile_keyword_pattern(_ASTRO_KEYWORD_TO_ENTITY)
+
 # Helper function to extract entities
 def extract_astro_entities(text: str) -> dict:
     """
     แยกแยะชื่อดาวและราศีจากข้อความ
     Returns: {'planets': [list of keys], 'zodiacs': [list of keys]}
     """
-    text_lower = text.lower()
+    matched = {_ASTRO_KEYWORD_TO_ENTITY[m.group(1)] for m in _ASTRO_ENTITY_RE.finditer(text.lower())}
     found = {'planets': [], 'zodiacs': []}
     
-    for key, keywords in ASTRO_SYSTEM_ENTITIES.items():
-        for kw in keywords:
-            if kw in text_lower:
-                # แยกประเภทว่าเป็นดาวหรือราศี (ง่ายๆ ด้วยการเช็ค key)
-                if key in ["aries", "taurus", "gemini", "cancer", "leo", "virgo", "libra", "scorpio", "sagittarius", "capricorn", "aquarius", "pisces"]:
-                    if key not in found['zodiacs']:
-                        found['zodiacs'].append(key)
-                else:
-                    if key not in found['planets']:
-                        found['planets'].append(key)
-                break
+    # เรียงตามลำดับใน ASTRO_SYSTEM_ENTITIES และแยกประเภทว่าเป็นดาวหรือราศี
+    for key in ASTRO_SYSTEM_ENTITIES:
+        if key in matched:
+            found['zodiacs' if key in ZODIAC_ENTITY_KEYS else 'planets'].append(key)
     return found
 
 
@@ -92,9 +101,74 @@ from config import ORIGINAL_DB_NAME
 # - ไม่ใช้ summary หรือข้อมูลที่ประมวลผลแล้ว
 # ============================
 
+# Projection สำหรับการ scan เอกสารเพื่อคำนวณ similarity
+# ตัด field ขนาดใหญ่ที่ retrieval ไม่ได้ใช้ (รูปภาพ base64 ใน original_image_chunks) ไม่ให้ส่งผ่าน network
+RETRIEVAL_SCAN_PROJECTION = {"image_base64": 0, "image_embeddings": 0}
+
+# collection ที่มีเอกสารมากกว่านี้จะใช้ $sample ตอนตรวจสอบ embeddings (ได้ตัวอย่างที่ไม่เอียงไปทางเอกสารเก่า)
+SAMPLE_PROBE_MIN_DOCS = 10000
+
+# จำนวนเอกสารต่อ batch ของ cursor ตอน scan (ค่า default 101 ทำให้ต้องไป-กลับ server หลายรอบ
+# สำหรับ chunk ขนาดเล็กที่เหลือหลัง projection)
+RETRIEVAL_SCAN_BATCH_SIZE = 500
+
+def decode_embedding(doc: dict):
+    """
+    อ่าน embedding ของเอกสารเป็น numpy array
+    รองรับทั้งแบบ int8 Binary (พร้อม embeddings_scale) และแบบ list ของ float รุ่นเก่า
+
+    Returns:
+        np.ndarray หรือ None ถ้าเอกสารไม่มี embedding
+    """
+    embedding = doc.get('embeddings')
+    if embedding is None or len(embedding) == 0:
+        return None
+    if isinstance(embedding, Binary):
+        # 2 bytes แรกของ BSON vector คือ dtype และ padding
+        quantized = np.frombuffer(embedding, dtype=np.int8, offset=2)
+        return quantized.astype(np.float32) * np.float32(doc.get('embeddings_scale', 1.0))
+    return np.array(embedding)
+
+@functools.lru_cache(maxsize=1024)
+def encode_query(text: str):
+    """
+    สร้าง embedding ของ query (cache ตามข้อความ: คำถามเดียวกันถูก encode ซ้ำหลายจุดใน request เดียว
+    และคำถามยอดนิยม/query คงที่ถูกถามซ้ำบ่อย)
+
+    Returns:
+        np.ndarray แบบอ่านอย่างเดียว (ใช้ร่วมกันระหว่างผู้เรียก ห้ามแก้ค่าในที่)
+    """
+    embedding = get_embedding_model().encode(text, convert_to_numpy=True)
+    embedding.setflags(write=False)
+    return embedding
+
 # ============================
 # MongoDB Connection Verification
 # ============================
+def get_collection_stats(collection) -> dict:
+    """
+    ดึงจำนวนเอกสารและขนาดข้อมูลของ collection จาก metadata ด้วย $collStats
+    (ไม่ต้อง scan เอกสารทั้งหมดเหมือน count_documents({}))
+
+    Returns:
+        dict: {'count': int, 'size': int, 'storage_size': int}
+            - size: ขนาดข้อมูลจริง (uncompressed) เป็น bytes
+            - storage_size: ขนาดที่ใช้บนดิสก์เป็น bytes
+    """
+    stats = {'count': 0, 'size': 0, 'storage_size': 0}
+    try:
+        # $collStats คืนค่า 1 เอกสารต่อ shard จึงต้องรวมผลทุกเอกสาร
+        for doc in collection.aggregate([{"$collStats": {"storageStats": {}, "count": {}}}]):
+            storage_stats = doc.get('storageStats', {})
+            stats['count'] += doc.get('count', storage_stats.get('count', 0))
+            stats['size'] += storage_stats.get('size', 0)
+            stats['storage_size'] += storage_stats.get('storageSize', 0)
+    except Exception as e:
+        # บาง cluster ไม่อนุญาต $collStats ให้ fallback เป็นการนับแบบเดิม
+        logger.debug(f"$collStats ไม่พร้อมใช้งานสำหรับ {collection.name}: {e}")
+        stats['count'] = collection.estimated_document_count()
+    return stats
+
 def verify_mongodb_connection_for_retrieval() -> Tuple[bool, str, dict]:
     """
     ตรวจสอบการเชื่อมต่อ MongoDB และเตรียมพร้อมสำหรับ retrieval
@@ -159,22 +233,49 @@ def verify_mongodb_connection_for_retrieval() -> Tuple[bool, str, dict]:
                 all_collections_have_data = False
             else:
                 collection = db[collection_name]
-                doc_count = collection.count_documents({})
+                collection_stats = get_collection_stats(collection)
+                doc_count = collection_stats['count']
                 total_docs += doc_count
                 
                 # ตรวจสอบว่ามี embeddings หรือไม่
+                # คำนวณขนาด embeddings บน server (ไม่ต้องดึง vector ทั้งก้อนผ่าน network)
                 has_embeddings = False
+                embedding_dim = 0
                 if doc_count > 0:
-                    sample_doc = collection.find_one()
-                    if sample_doc and 'embeddings' in sample_doc:
-                        emb = sample_doc['embeddings']
-                        if isinstance(emb, (list, tuple)) and len(emb) > 0:
-                            has_embeddings = True
-                
+                    # $sample สุ่มเอกสารเฉพาะ collection ขนาดใหญ่ ส่วน collection เล็กใช้เอกสารแรกก็พอ
+                    if doc_count > SAMPLE_PROBE_MIN_DOCS:
+                        probe_stage = {"$sample": {"size": 1}}
+                    else:
+                        probe_stage = {"$limit": 1}
+                    sample_doc = next(collection.aggregate([
+                        probe_stage,
+                        {"$project": {
+                            "_id": 0,
+                            # list ของ float ใช้ $size ส่วน int8 Binary ใช้จำนวน byte ลบ header 2 bytes
+                            "embedding_dim": {"$cond": [
+                                {"$isArray": "$embeddings"},
+                                {"$size": "$embeddings"},
+                                {"$cond": [
+                                    {"$eq": [{"$type": "$embeddings"}, "binData"]},
+                                    {"$subtract": [{"$binarySize": "$embeddings"}, 2]},
+                                    0
+                                ]}
+                            ]}
+                        }}
+                    ]), None)
+                    if sample_doc:
+                        embedding_dim = sample_doc.get('embedding_dim', 0)
+                        has_embeddings = embedding_dim > 0
+
                 collections_status[collection_name] = {
                     'exists': True,
                     'doc_count': doc_count,
-                    'has_embeddings': has_embeddings
+                    'has_embeddings': has_embeddings,
+                    'embedding_dim': embedding_dim,
+                    'size_bytes': collection_stats['size'],
+                    'storage_size_bytes': collection_stats['storage_size'],
+                    # ขนาดเฉลี่ยต่อเอกสาร (BSON) จาก metadata แทนการดึงเอกสารมาวัดขนาดเอง
+                    'avg_doc_size_bytes': collection_stats['size'] // doc_count if doc_count else 0
                 }
                 
                 if doc_count == 0:
@@ -405,9 +506,9 @@ def store_user_response(
         
         # 🆕 สร้าง embeddings สำหรับ question และ answer เพื่อใช้ใน Semantic Similarity
         try:
-            model = SentenceTransformer("minishlab/potion-multilingual-128M", device="cpu")
-            question_embedding = model.encode(question, convert_to_numpy=True).tolist()
-            answer_embedding = model.encode(answer, convert_to_numpy=True).tolist()
+            model = get_embedding_model()
+            # encode คำถามและคำตอบใน batch เดียว
+            question_embedding, answer_embedding = model.encode([question, answer], convert_to_numpy=True).tolist()
             logger.debug(f"✅ Created embeddings for question and answer (dim: {len(question_embedding)})")
         except Exception as e:
             logger.warning(f"⚠️ Failed to create embeddings: {e}")
@@ -902,11 +1003,10 @@ def calculate_semantic_similarity(text1: str, text2: str, model=None) -> float:
         
         # โหลด embedding model ถ้ายังไม่มี
         if model is None:
-            model = SentenceTransformer("minishlab/potion-multilingual-128M", device="cpu")
+            model = get_embedding_model()
         
         # สร้าง embeddings
-        embedding1 = model.encode(text1, convert_to_numpy=True)
-        embedding2 = model.encode(text2, convert_to_numpy=True)
+        embedding1, embedding2 = model.encode([text1, text2], convert_to_numpy=True)
         
         # คำนวณ cosine similarity
         similarity = np.dot(embedding1, embedding2) / (
@@ -959,10 +1059,10 @@ def check_follow_up_question_with_semantic_similarity(
             return False, 0.0
         
         # โหลด embedding model
-        model = SentenceTransformer("minishlab/potion-multilingual-128M", device="cpu")
+        model = get_embedding_model()
         
         # สร้าง embedding สำหรับคำถามปัจจุบัน
-        current_question_embedding = model.encode(question, convert_to_numpy=True)
+        current_question_embedding = encode_query(question)
         
         # ดึงข้อมูลบริบทก่อนหน้า
         last_question = user_context.get("last_question", "")
@@ -1516,12 +1616,10 @@ def ask_question_to_rag(question: str, user_id: str = "unknown", provided_chart_
             print(f"   การค้นหาจาก MongoDB ถูกข้าม")
             retrieved_docs = []
         else:
-            # โหลด embedding model
             import numpy as np
             
-            # ใช้ CPU เพื่อหลีกเลี่ยงปัญหา MPS device
-            model = SentenceTransformer("minishlab/potion-multilingual-128M", device="cpu")
-            query_embedding = model.encode(question)
+            # encode_query โหลด embedding model (CPU) ให้เองครั้งแรก
+            query_embedding = encode_query(question)
             print(f"✅ สร้าง query embedding สำเร็จ (ขนาด: {len(query_embedding)} dimensions)")
             
             # ============================================================
@@ -1582,7 +1680,7 @@ def ask_question_to_rag(question: str, user_id: str = "unknown", provided_chart_
                             collection = db[collection_name]
                             
                             # ดึงข้อมูลทั้งหมด
-                            docs = list(collection.find({}))
+                            docs = list(collection.find({}, RETRIEVAL_SCAN_PROJECTION).batch_size(RETRIEVAL_SCAN_BATCH_SIZE))
                             print(f"   พบเอกสารใน {collection_name}: {len(docs)} เอกสาร")
                             
                             # Debug: แสดงโครงสร้างของเอกสารแรก (ถ้ามี)
@@ -1592,8 +1690,8 @@ def ask_question_to_rag(question: str, user_id: str = "unknown", provided_chart_
                                 print(f"      - Fields: {list(first_doc.keys())}")
                                 print(f"      - มี 'embeddings': {'embeddings' in first_doc}")
                                 if 'embeddings' in first_doc:
-                                    emb = first_doc['embeddings']
-                                    print(f"      - Embedding type: {type(emb)}, length: {len(emb) if isinstance(emb, (list, np.ndarray)) else 'N/A'}")
+                                    emb = decode_embedding(first_doc)
+                                    print(f"      - Embedding type: {type(first_doc['embeddings'])}, length: {len(emb) if emb is not None else 'N/A'}")
                                 print(f"      - มี 'text': {'text' in first_doc}")
                             
                             if docs:
@@ -1611,7 +1709,7 @@ def ask_question_to_rag(question: str, user_id: str = "unknown", provided_chart_
                                     
                                     try:
                                         # ✅ embeddings ถูกสร้างจาก text
-                                        doc_embedding = np.array(doc['embeddings'])
+                                        doc_embedding = decode_embedding(doc)
                                         
                                         # ตรวจสอบว่า dimensions ตรงกัน
                                         if len(doc_embedding) != len(query_embedding):
@@ -1643,12 +1741,12 @@ def ask_question_to_rag(question: str, user_id: str = "unknown", provided_chart_
                                     # 🆕 ถ้าไม่มี similarities และมีวันเกิด ให้ลองใช้ query ที่ง่ายกว่า
                                     if birth_info_from_question and birth_info_from_question.get('date'):
                                         print(f"   🔄 ลองใช้ query ที่ง่ายกว่า: 'โหราศาสตร์'")
-                                        simple_query_emb = model.encode("โหราศาสตร์")
+                                        simple_query_emb = encode_query("โหราศาสตร์")
                                         simple_similarities = []
                                         for doc in docs:
                                             if 'embeddings' in doc:
                                                 try:
-                                                    doc_emb = np.array(doc['embeddings'])
+                                                    doc_emb = decode_embedding(doc)
                                                     if len(doc_emb) == len(simple_query_emb):
                                                         sim = np.dot(simple_query_emb, doc_emb) / (
                                                             np.linalg.norm(simple_query_emb) * np.linalg.norm(doc_emb)
@@ -1682,6 +1780,10 @@ def ask_question_to_rag(question: str, user_id: str = "unknown", provided_chart_
                                 # Extract entities from query for boosting
                                 query_entities = extract_astro_entities(question)
                                 query_planets = query_entities.get('planets', [])
+                                # keywords ของดาวทุกดวงในคำถามรวมเป็น regex เดียว (boost ครั้งเดียวถ้าเจอดวงใดก็ได้)
+                                planet_boost_re = compile_keyword_pattern(
+                                    kw for planet in query_planets for kw in ASTRO_SYSTEM_ENTITIES.get(planet, [])
+                                ) if query_planets else None
                                 
                                 boosted_similarities = []
                                 for score, doc in similarities:
@@ -1704,12 +1806,8 @@ def ask_question_to_rag(question: str, user_id: str = "unknown", provided_chart_
                                             boost_score += 0.15
                                             
                                     # 3. Planet Boost (+0.1)
-                                    for planet in query_planets:
-                                        # Check keywords for planet
-                                        keywords = ASTRO_SYSTEM_ENTITIES.get(planet, [])
-                                        if any(kw in text.lower() for kw in keywords):
-                                            boost_score += 0.1
-                                            break # Boost only once per planet
+                                    if planet_boost_re is not None and planet_boost_re.search(text.lower()):
+                                        boost_score += 0.1
                                             
                                     boosted_similarities.append((boost_score, doc))
                                 
@@ -2990,8 +3088,8 @@ def ask_question_to_rag_for_evaluation(question: str, provided_chart_info: dict
             import numpy as np
             
             # ใช้ CPU เพื่อหลีกเลี่ยงปัญหา MPS device
-            model = SentenceTransformer("minishlab/potion-multilingual-128M", device="cpu")
-            query_embedding = model.encode(question)
+            model = get_embedding_model()
+            query_embedding = encode_query(question)
             print(f"[EVAL] ✅ สร้าง query embedding สำเร็จ (ขนาด: {len(query_embedding)} dimensions)")
             
             collections_to_search = [
@@ -3021,7 +3119,7 @@ def ask_question_to_rag_for_evaluation(question: str, provided_chart_info: dict
                                 continue
                             
                             collection = db[collection_name]
-                            docs = list(collection.find({}))
+                            docs = list(collection.find({}, RETRIEVAL_SCAN_PROJECTION).batch_size(RETRIEVAL_SCAN_BATCH_SIZE))
                             
                             if docs:
                                 # คำนวณ similarity scores
@@ -3031,7 +3129,7 @@ def ask_question_to_rag_for_evaluation(question: str, provided_chart_info: dict
                                         continue
                                     
                                     try:
-                                        doc_embedding = np.array(doc['embeddings'])
+                                        doc_embedding = decode_embedding(doc)
                                         
                                         if len(doc_embedding) != len(query_embedding):
                                             continue
@@ -3329,7 +3427,7 @@ def ask_question_to_rag_for_evaluation(question: str, provided_chart_info: dict
             debug_client = MongoClient(mongo_uri)
             debug_db = debug_client[db_name]
             collection = debug_db[coll_name]
-            doc_count = collection.count_documents({})
+            doc_count = collection.estimated_document_count()
             print(f"[DEBUG] CONNECTED TO: DB={db_name}, COLL={coll_name}, DOCS={doc_count}")
             
         except Exception as e:
@@ -3346,19 +3444,20 @@ def ask_question_to_rag_for_evaluation(question: str, provided_chart_info: dict
             # Pull all docs once
             all_docs = list(collection.find(
                 {},
-                {"text": 1, "embeddings": 1, "source": 1, "_id": 0}
-            ))
+                {"text": 1, "embeddings": 1, "embeddings_scale": 1, "source": 1, "_id": 0}
+            ).batch_size(RETRIEVAL_SCAN_BATCH_SIZE))
 
             print(f"[DEBUG] Total docs fetched for supplementary: {len(all_docs)}")
-            for query in aspect_queries:
-                q_embed = model.encode(query)
+            # encode ทุก aspect query ใน batch เดียว
+            aspect_embeddings = model.encode(aspect_queries)
+            for query, q_embed in zip(aspect_queries, aspect_embeddings):
                 
                 # Find docs for this aspect
                 candidates = []
                 
                 for doc in all_docs:
                     if 'embeddings' in doc and doc['embeddings']:
-                        doc_emb = np.array(doc['embeddings'])
+                        doc_emb = decode_embedding(doc)
                         sim = cosine_similarity([q_embed], [doc_emb])[0][0]
                         
                         text_lower = doc.get('text', '').lower()
@@ -1,11 +1,12 @@
 import os
 import json
 import random
+import asyncio
 import pandas as pd
 from pymongo import MongoClient
 from dotenv import load_dotenv
-from openai import OpenAI
-from tqdm import tqdm
+from openai import AsyncOpenAI
+from tqdm.asyncio import tqdm_asyncio
 
 # Load environment variables
 load_dotenv()
@@ -18,6 +19,7 @@ COLLECTIONS = ["original_text_chunks", "original_image_chunks", "original_table_
 
 KEYWORDS = ["วันเดือนปีเกิด", "เวลาเกิด", "การงาน", "การเงิน", "ความรัก", "สีมงคล"]
 TARGET_COUNT = 120
+QA_CONCURRENCY = 16  # จำนวน request ไปยัง OpenAI ที่ส่งพร้อมกันได้สูงสุด
 
 def get_mongo_client():
     try:
@@ -42,7 +44,7 @@ def fetch_candidate_chunks(client, db_name, collections, keywords, limit_per_key
             continue
             
         collection = db[collection_name]
-        doc_count = collection.count_documents({})
+        doc_count = collection.estimated_document_count()
         print(f"   📂 Collection '{collection_name}' มีทั้งหมด {doc_count} เอกสาร")
         
         for keyword in keywords:
@@ -79,13 +81,10 @@ def fetch_candidate_chunks(client, db_name, collections, keywords, limit_per_key
         
     return candidates
 
-def generate_qa_pair(client_openai, context):
-    prompt = f"""
-    ข้อมูลบริบทอยู่ด้านล่างนี้
-    ---------------------
-    {context}
-    ---------------------
-    จากข้อมูลบริบทที่กำหนดให้ (และห้ามใช้ความรู้อื่นนอกเหนือจากบริบท)
+# คำสั่งที่เหมือนกันทุก chunk อยู่ใน system message (ส่วนที่ต่างกันมีแค่บริบท ทำให้ OpenAI cache prefix ได้)
+QA_SYSTEM_PROMPT = """You are a helpful assistant that generates Q&A pairs from text.
+
+    จากข้อมูลบริบทที่ผู้ใช้ส่งมา (และห้ามใช้ความรู้อื่นนอกเหนือจากบริบท)
     ให้สร้าง "คำถาม" และ "คำตอบ" จำนวน 1 คู่
     
     91:     ข้อกำหนดสำคัญ (Critical Requirement):
@@ -100,25 +99,46 @@ def generate_qa_pair(client_openai, context):
     - คำตอบ: ภาษาไทย ตอบตามเนื้อหาในบริบทอย่างเคร่งครัด กระชับ และตรงประเด็น
     
     Format the output as JSON:
-    {{
+    {
         "question": "คำถามภาษาไทยที่ระบุวันเวลาเกิด",
         "answer": "คำตอบภาษาไทย"
-    }}
+    }
+"""
+
+async def generate_qa_pair(client_openai, context, semaphore):
+    prompt = f"""
+    ข้อมูลบริบทอยู่ด้านล่างนี้
+    ---------------------
+    {context}
+    ---------------------
     """
     
+    async with semaphore:
+        try:
+            response = await client_openai.chat.completions.create(
+                model="gpt-4o-mini",
+                messages=[
+                    {"role": "system", "content": QA_SYSTEM_PROMPT},
+                    {"role": "user", "content": prompt}
+                ],
+                response_format={"type": "json_object"}
+            )
+            return json.loads(response.choices[0].message.content)
+        except Exception as e:
+            print(f"Error generating Q&A: {e}")
+            return None
+
+async def generate_qa_pairs(contexts):
+    """ส่ง request สร้าง Q&A ทุก chunk พร้อมกัน (จำกัดจำนวนด้วย semaphore) ผลลัพธ์เรียงตาม contexts"""
+    client_openai = AsyncOpenAI(api_key=OPENAI_API_KEY)
+    semaphore = asyncio.Semaphore(QA_CONCURRENCY)
     try:
-        response = client_openai.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[
-                {"role": "system", "content": "You are a helpful assistant that generates Q&A pairs from text."},
-                {"role": "user", "content": prompt}
-            ],
-            response_format={"type": "json_object"}
+        return await tqdm_asyncio.gather(
+            *[generate_qa_pair(client_openai, context, semaphore) for context in contexts],
+            desc="Generating"
         )
-        return json.loads(response.choices[0].message.content)
-    except Exception as e:
-        print(f"Error generating Q&A: {e}")
-        return None
+    finally:
+        await client_openai.close()
 
 def main():
     if not MONGO_URL:
@@ -148,13 +168,12 @@ def main():
         selected_chunks = candidates # Take all
     
     print(f"\n--- ขั้นตอนการสร้าง Q&A ด้วย LLM ({len(selected_chunks)} รายการ) ---")
-    openai_client = OpenAI(api_key=OPENAI_API_KEY)
+    qa_pairs = asyncio.run(generate_qa_pairs([chunk['text'] for chunk in selected_chunks]))
     
     dataset = []
     
-    for i, chunk in enumerate(tqdm(selected_chunks, desc="Generating")):
+    for i, (chunk, qa) in enumerate(zip(selected_chunks, qa_pairs)):
         try:
-            qa = generate_qa_pair(openai_client, chunk['text'])
             if qa:
                 dataset.append({
                     "question": qa['question'],